@@ -0,0 +1,243 @@
+import hashlib
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from connection_pool import ConnectionPool
+from tracing import get_tracer
+from vector_codec import EMBEDDING_DIMENSION, VECTOR_TYPE, encode_vector, vector_parameter
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedAnswer:
+    response: str
+    similarity: float
+    created_at: float
+
+
+@dataclass
+class AnswerCacheStats:
+    lookups: int
+    hits: int
+    stores: int
+    evictions: int
+    errors: int = 0  # failed lookups and stores, answered by the LLM / skipped instead
+
+    @property
+    def misses(self) -> int:
+        return self.lookups - self.hits
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+
+class InMemoryAnswerStore:
+    """Process-local answer store with TTL expiry and LRU eviction."""
+
+    dimension = None  # accepts embeddings of any size
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 86400.0) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        # entry id -> (context key, unit prompt embedding, response, created at), least recently used first.
+        self._entries: OrderedDict[int, tuple[str, np.ndarray, str, float]] = OrderedDict()
+        self._by_context: dict[str, set[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _remove(self, entry_id: int) -> None:
+        context_key = self._entries.pop(entry_id)[0]
+        ids = self._by_context[context_key]
+        ids.discard(entry_id)
+        if not ids:
+            del self._by_context[context_key]
+        self.evictions += 1
+
+    def find(self, embedding: np.ndarray, context_key: str, threshold: float) -> CachedAnswer | None:
+        with self._lock:
+            cutoff = time.time() - self.ttl_seconds
+            for entry_id in [i for i in self._by_context.get(context_key, ()) if self._entries[i][3] < cutoff]:
+                self._remove(entry_id)
+            ids = list(self._by_context.get(context_key, ()))
+            if not ids:
+                return None
+            # Only prompts that retrieved the same context are candidates, so this is a handful of rows.
+            scores = np.stack([self._entries[i][1] for i in ids]) @ embedding
+            best = int(np.argmax(scores))
+            if scores[best] < threshold:
+                return None
+            self._entries.move_to_end(ids[best])
+            _, _, response, created_at = self._entries[ids[best]]
+            return CachedAnswer(response, float(scores[best]), created_at)
+
+    def add(self, embedding: np.ndarray, context_key: str, response: str) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            while len(self._entries) >= self.max_entries:
+                self._remove(next(iter(self._entries)))
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (context_key, embedding, response, time.time())
+            self._by_context.setdefault(context_key, set()).add(entry_id)
+
+
+class IRISAnswerStore:
+    """Answer store in RAG_Application.AnswerCache, shared by every app process.
+
+    Lookups use the same VECTOR_DOT_PRODUCT ranking as VectorSearch, restricted to rows with the
+    same context key. Expired rows are deleted and the least recently hit rows evicted every
+    ``maintenance_interval`` stores.
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        max_entries: int = 100000,
+        ttl_seconds: float = 86400.0,
+        dimension: int = EMBEDDING_DIMENSION,
+        maintenance_interval: int = 100,
+    ) -> None:
+        self.pool = pool
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.dimension = dimension
+        self.maintenance_interval = maintenance_interval
+        self.evictions = 0
+        self._stores = 0
+        self._lock = threading.Lock()
+
+        with self.pool.cursor() as iris_cursor:
+            iris_cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS RAG_Application.AnswerCache (
+                    ContextKey VARCHAR(500),
+                    PromptEmbedding VECTOR({VECTOR_TYPE}, {dimension}),
+                    Response VARCHAR(32000),
+                    CreatedAt DOUBLE,
+                    LastHitAt DOUBLE
+                )
+            """)
+            iris_cursor.execute("CREATE INDEX IF NOT EXISTS ContextKeyIdx ON RAG_Application.AnswerCache (ContextKey)")
+
+    def find(self, embedding: np.ndarray, context_key: str, threshold: float) -> CachedAnswer | None:
+        query = f"""SELECT TOP 1 ID, Response, CreatedAt,
+                        VECTOR_DOT_PRODUCT(PromptEmbedding, {vector_parameter(self.dimension)}) AS Similarity
+                    FROM RAG_Application.AnswerCache
+                    WHERE ContextKey = ? AND CreatedAt > ?
+                    ORDER BY Similarity DESC
+                    """
+        now = time.time()
+        with self.pool.cursor() as iris_cursor:
+            iris_cursor.execute(query, [encode_vector(embedding, self.dimension), context_key, now - self.ttl_seconds])
+            row = iris_cursor.fetchone()
+            if row is None or row[3] < threshold:
+                return None
+            iris_cursor.execute("UPDATE RAG_Application.AnswerCache SET LastHitAt = ? WHERE ID = ?", [now, row[0]])
+        return CachedAnswer(row[1], float(row[3]), row[2])
+
+    def add(self, embedding: np.ndarray, context_key: str, response: str) -> None:
+        if self.max_entries <= 0:
+            return
+        now = time.time()
+        with self.pool.cursor() as iris_cursor:
+            iris_cursor.execute(
+                f"""INSERT INTO RAG_Application.AnswerCache (ContextKey, PromptEmbedding, Response, CreatedAt, LastHitAt)
+                    VALUES (?, {vector_parameter(self.dimension)}, ?, ?, ?)""",
+                [context_key, encode_vector(embedding, self.dimension), response, now, now],
+            )
+            with self._lock:
+                self._stores += 1
+                maintain = self._stores % self.maintenance_interval == 0
+            if maintain:
+                self._evict(iris_cursor, now)
+
+    def _evict(self, iris_cursor, now: float) -> None:
+        iris_cursor.execute("DELETE FROM RAG_Application.AnswerCache WHERE CreatedAt <= ?", [now - self.ttl_seconds])
+        evicted = max(iris_cursor.rowcount, 0)
+        iris_cursor.execute("SELECT COUNT(*) FROM RAG_Application.AnswerCache")
+        excess = iris_cursor.fetchone()[0] - self.max_entries
+        if excess > 0:
+            iris_cursor.execute(f"""DELETE FROM RAG_Application.AnswerCache
+                                    WHERE ID IN (SELECT TOP {excess} ID FROM RAG_Application.AnswerCache ORDER BY LastHitAt)""")
+            evicted += excess
+        with self._lock:
+            self.evictions += evicted
+
+
+class SemanticAnswerCache:
+    """Answers near-duplicate prompts from earlier responses instead of calling the LLM.
+
+    A cached response is reused when the new prompt's embedding has at least ``threshold``
+    cosine similarity with a cached prompt *and* the same context: retrieval returned the same
+    stories and the conversation so far is the same (see context_key). An answer is never reused
+    for a prompt grounded in different documents, or in another session's history. The cache fails open:
+    a store error is logged and counted, and the lookup misses or the answer isn't stored.
+    """
+
+    def __init__(self, store: InMemoryAnswerStore | IRISAnswerStore, threshold: float = 0.95) -> None:
+        self.store = store
+        self.threshold = threshold
+        self._lookups = 0
+        self._hits = 0
+        self._stores = 0
+        self._errors = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def context_key(namespace: str, story_ids, history: str = "") -> str:
+        # namespace separates answers from different LLM / embedding model combinations; ids may be int or str.
+        # history is the conversation summary the answer was generated with: answers depend on it, and the
+        # cache is shared by every session, so only turns with the same (usually empty) summary may share one.
+        history_hash = hashlib.sha256(history.encode("utf-8")).hexdigest()
+        return f"{namespace}|{history_hash}|{','.join(sorted({str(story_id) for story_id in story_ids}))}"
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        embedding = np.asarray(embedding, dtype=np.float32)
+        return embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+    def supports(self, embedding) -> bool:
+        return self.store.dimension in (None, len(embedding))
+
+    def lookup(self, embedding, context_key: str) -> CachedAnswer | None:
+        with get_tracer().span("answer_cache.lookup") as span:
+            answer = None
+            if self.supports(embedding):
+                try:
+                    answer = self.store.find(self._unit(embedding), context_key, self.threshold)
+                except Exception as error:
+                    logger.warning("Answer cache lookup failed, calling the LLM instead: %r", error)
+                    with self._lock:
+                        self._errors += 1
+            span.set(hits=int(answer is not None))
+        with self._lock:
+            self._lookups += 1
+            self._hits += answer is not None
+        return answer
+
+    def add(self, embedding, context_key: str, response: str) -> None:
+        if not self.supports(embedding) or self.store.max_entries <= 0:
+            return
+        try:
+            self.store.add(self._unit(embedding), context_key, response)
+        except Exception as error:
+            logger.warning("Storing an answer in the cache failed: %r", error)
+            with self._lock:
+                self._errors += 1
+            return
+        with self._lock:
+            self._stores += 1
+
+    def stats(self) -> AnswerCacheStats:
+        with self._lock:
+            return AnswerCacheStats(lookups=self._lookups, hits=self._hits, stores=self._stores, evictions=self.store.evictions,
+                                   errors=self._errors)
@@ -0,0 +1,2 @@
+# Offline benchmarks for the RAG app. Run from notebooks/rag_app, e.g.:
+#   python -m benchmarks.codec_bench
@@ -0,0 +1,44 @@
+import argparse
+import timeit
+
+import numpy as np
+
+from vector_codec import EMBEDDING_DIMENSION, encode_vector
+
+
+def _legacy_query(vector: np.ndarray) -> str:
+    # What VectorSearch used to send: str() of the tolist() of the embedding.
+    return str(vector.tolist())
+
+
+def _legacy_ingest(vector: np.ndarray) -> str:
+    # What data_loader.ipynb used to send.
+    return str(vector.tolist())[1:-1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare vector parameter encodings.")
+    parser.add_argument("--number", type=int, default=2000, help="encodes per measurement")
+    parser.add_argument("--dimension", type=int, default=EMBEDDING_DIMENSION)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vector32 = rng.standard_normal(args.dimension).astype(np.float32)
+    vector32 /= np.linalg.norm(vector32)
+    vector64 = vector32.astype(np.float64)
+
+    cases = [
+        ("str(list) query path", lambda: _legacy_query(vector32)),
+        ("str(list)[1:-1] ingest path", lambda: _legacy_ingest(vector32)),
+        ("vector_codec float32", lambda: encode_vector(vector32, args.dimension)),
+        ("vector_codec float64", lambda: encode_vector(vector64, args.dimension)),
+    ]
+
+    print(f"{'encoding':<30}{'us/vector':>12}{'bytes':>10}")
+    for name, encode in cases:
+        seconds = min(timeit.repeat(encode, number=args.number, repeat=3)) / args.number
+        print(f"{name:<30}{seconds * 1e6:>12.1f}{len(encode().encode()):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from local_index import DEFAULT_SNAPSHOT_DIR, LocalVectorSearch, VectorSnapshot
+from vector_codec import EMBEDDING_DIMENSION
+
+
+def _synthetic_snapshot(directory: str, stories: int, questions_per_story: int, seed: int) -> None:
+    # Clustered unit vectors, which is closer to real sentence embeddings than isotropic noise.
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((max(1, stories // 20), EMBEDDING_DIMENSION)).astype(np.float32)
+
+    def sample(n: int) -> np.ndarray:
+        vectors = topics[rng.integers(0, len(topics), n)] + 0.5 * rng.standard_normal((n, EMBEDDING_DIMENSION)).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    story_ids = list(range(1, stories + 1))
+    VectorSnapshot(directory, "stories").append(story_ids, story_ids, sample(stories), [[f"Story {i}"] for i in story_ids])
+    question_count = stories * questions_per_story
+    VectorSnapshot(directory, "questions").append(
+        list(range(1, question_count + 1)),
+        [i // questions_per_story + 1 for i in range(question_count)],
+        sample(question_count),
+        [[f"Question {i}", f"Answer {i}"] for i in range(question_count)],
+    )
+
+
+def _measure(search, queries: np.ndarray, top_k: int) -> tuple[list, float]:
+    start = time.perf_counter()
+    results = [[story_id for _, story_id in search(query, top_k)] for query in queries]
+    return results, (time.perf_counter() - start) / len(queries)
+
+
+def _recall(expected: list, actual: list) -> float:
+    return float(np.mean([len(set(e) & set(a)) / max(1, len(set(e))) for e, a in zip(expected, actual)]))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Recall@k and latency of the local vector index against exact and SQL search.")
+    parser.add_argument("--directory", help=f"existing snapshot to use (e.g. {DEFAULT_SNAPSHOT_DIR}); default builds a synthetic one")
+    parser.add_argument("--stories", type=int, default=7000)
+    parser.add_argument("--questions-per-story", type=int, default=15)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--n-probe", type=int, default=8)
+    parser.add_argument("--sql", action="store_true", help="also compare against VectorSearch on the configured IRIS instance (needs --directory)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.sql and not args.directory:
+        # IRIS holds the loaded corpus, so recall is only meaningful against a snapshot of it.
+        parser.error("--sql needs --directory pointing at a snapshot of the same IRIS instance (see local_index.py)")
+
+    directory = args.directory or tempfile.mkdtemp(prefix="vector_snapshot_")
+    if not args.directory:
+        _synthetic_snapshot(directory, args.stories, args.questions_per_story, args.seed)
+
+    exact = LocalVectorSearch(directory)
+    start = time.perf_counter()
+    approximate = LocalVectorSearch(directory, approximate=True, n_probe=args.n_probe)
+    print(f"stories={exact.stories.count} questions={exact.questions.count} ivf_build={time.perf_counter() - start:.2f}s")
+
+    # Queries are perturbed question embeddings, so every query has a clear nearest neighbourhood.
+    rng = np.random.default_rng(args.seed + 1)
+    rows = rng.choice(exact.questions.count, min(args.queries, exact.questions.count), replace=False)
+    queries = np.asarray(exact.questions.vectors[np.sort(rows)]) + 0.05 * rng.standard_normal((len(rows), EMBEDDING_DIMENSION)).astype(np.float32)
+
+    backends = [("local exact", exact), ("local ivf", approximate)]
+    if args.sql:
+        from vector_search import VectorSearch
+        backends.append(("iris sql", VectorSearch()))
+
+    print(f"{'backend':<14}{'method':<20}{'ms/query':>10}{'recall@' + str(args.top_k):>12}")
+    for method in ("search_by_q_and_a", "search_by_story"):
+        reference, _ = _measure(getattr(exact, method), queries, args.top_k)
+        for name, backend in backends:
+            results, seconds = _measure(getattr(backend, method), queries, args.top_k)
+            print(f"{name:<14}{method:<20}{seconds * 1e3:>10.2f}{_recall(reference, results):>12.3f}")
+
+    start = time.perf_counter()
+    exact.search_many_by_q_and_a(queries, args.top_k)
+    print(f"local exact search_many_by_q_and_a: {(time.perf_counter() - start) / len(queries) * 1e3:.2f} ms/query")
+
+
+if __name__ == "__main__":
+    main()
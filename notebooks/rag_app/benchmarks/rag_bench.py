@@ -0,0 +1,292 @@
+"""End-to-end benchmark of ingestion and of a chat turn, without IRIS or OpenAI.
+
+The corpus (the dspy examples in notebooks/questions.py plus a synthetic CoQA-shaped corpus)
+is loaded with ingest.run_ingest into benchmarks.standins.StandInIRIS. Each question is then
+run through the same stages as streamlit_app.py: encode, VectorSearch.retrieve_context (with
+chunks from the chunk index), context packing and prompt assembly (prompt_builder.py), and a
+streamed answer from a stub LLM.
+
+    python -m benchmarks.rag_bench                                   # hashing encoder, 500 synthetic stories
+    python -m benchmarks.rag_bench --encoder model --output run.json # the real embedding model
+    python -m benchmarks.rag_bench --output new.json --compare run.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+
+from connection_pool import ConnectionPool
+from embedding_models import DEFAULT_EMBEDDING_MODEL
+from ingest import run_ingest
+from llm_streaming import TimedStream
+from prompt_builder import DEFAULT_CHUNK_TOP_K, DEFAULT_TOKEN_BUDGET, build_prompt, count_tokens, pack_context, relevant_documents
+from vector_search import VectorSearch
+
+from benchmarks.standins import HashingEncoder, StandInIRIS, StubLLM
+
+NOTEBOOKS_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+STAGES = ("encode", "retrieve", "context", "prompt", "llm_first_token", "llm_total", "turn")
+
+_SYLLABLES = ["ka", "lo", "mi", "ren", "tu", "sa", "vek", "do", "ni", "par", "el", "gor", "hu", "zi", "bam", "qu"]
+
+
+@dataclass
+class Query:
+    question: str
+    story_id: int
+    workload: str
+
+
+def example_corpus() -> list[dict]:
+    # questions.py needs dspy, which the app itself doesn't depend on.
+    sys.path.append(NOTEBOOKS_DIR)
+    try:
+        from questions import examples
+    except ImportError as error:
+        print(f"Skipping the questions.py examples ({error})")
+        return []
+    return [
+        {"source": "dspy", "story": example.context, "questions": [example.question], "answers": {"input_text": [example.answer]}}
+        for example in examples
+    ]
+
+
+def synthetic_corpus(stories: int, questions_per_story: int, sentences: int = 8, seed: int = 0) -> list[dict]:
+    """CoQA-shaped stories of pseudo-words; each story draws on its own small vocabulary.
+
+    Questions are fragments of one of their story's sentences, so the story they came from
+    is the right retrieval result.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(["".join(rng.choice(_SYLLABLES, size=rng.integers(2, 4))) for _ in range(5000)])
+    corpus = []
+    for _ in range(stories):
+        topic = rng.choice(vocabulary, size=30, replace=False)
+        story_sentences = [" ".join(rng.choice(topic, size=12)) + "." for _ in range(sentences)]
+        questions = [
+            " ".join(story_sentences[rng.integers(sentences)].rstrip(".").split()[:8]) + "?"
+            for _ in range(questions_per_story)
+        ]
+        corpus.append({
+            "source": "synthetic",
+            "story": " ".join(story_sentences),
+            "questions": questions,
+            "answers": {"input_text": [str(rng.choice(topic)) for _ in questions]},
+        })
+    return corpus
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"count": len(samples), "mean": float(np.mean(samples)), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def peak_rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def bench_ingest(dataset: list[dict], encoder, pool: ConnectionPool, commit_size: int) -> dict:
+    commit_seconds: list[float] = []
+    last = [time.perf_counter()]
+
+    def progress(stats) -> None:
+        now = time.perf_counter()
+        commit_seconds.append(now - last[0])
+        last[0] = now
+
+    stats = run_ingest(dataset, encoder, pool, split="benchmark", commit_size=commit_size, checkpoint_path=None, progress=progress)
+    return {
+        "stories": stats.stories,
+        "questions": stats.questions,
+        "elapsed_seconds": stats.elapsed_seconds,
+        "encode_seconds": stats.encode_seconds,
+        "write_seconds": stats.write_seconds,
+        "rows_per_second": stats.rows_per_second,
+        "embeddings_per_second": stats.embeddings_per_second,
+        "commit_seconds": percentiles(commit_seconds),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+@dataclass
+class TurnSettings:
+    top_k: int = 2
+    story_top_k: int = 1
+    chunk_top_k: int = DEFAULT_CHUNK_TOP_K  # 0 splits the retrieved stories per request instead
+    token_budget: int = DEFAULT_TOKEN_BUDGET
+
+
+def run_turn(query: Query, encoder, search: VectorSearch, llm: StubLLM, settings: TurnSettings) -> tuple[dict, dict]:
+    timings = {}
+    started = time.perf_counter()
+
+    embedding = encoder.encode(query.question)
+    timings["encode"] = time.perf_counter() - started
+
+    stage_start = time.perf_counter()
+    context = search.retrieve_context(embedding, top_k=settings.top_k, story_top_k=settings.story_top_k, examples_top_k=1,
+                                      chunk_top_k=settings.chunk_top_k)
+    timings["retrieve"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    if context.chunks:
+        packed = pack_context(context.chunks, settings.token_budget)
+        relevant_docs, context_story_ids = packed.chunks, packed.story_ids
+    else:
+        relevant_docs = relevant_documents(context)
+        context_story_ids = [story_id for _, story_id in context.documents[:1]]
+    timings["context"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    template = build_prompt(query.question, context.q_and_a_docs, relevant_docs)
+    timings["prompt"] = time.perf_counter() - stage_start
+
+    stream = TimedStream(llm.stream(template))
+    for _ in stream:
+        pass
+    timings["llm_first_token"] = stream.time_to_first_token or 0.0
+    timings["llm_total"] = stream.total_seconds
+    timings["turn"] = time.perf_counter() - started
+    retrieved = {
+        "documents": [story_id for _, story_id in context.documents],
+        "story_documents": [story_id for _, story_id in context.story_documents],
+        "context": context_story_ids,
+    }
+    return timings, {"retrieved": retrieved, "prompt_tokens": count_tokens(template)}
+
+
+def bench_turns(queries: list[Query], encoder, search: VectorSearch, llm: StubLLM, settings: TurnSettings, concurrency: int) -> dict:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda query: run_turn(query, encoder, search, llm, settings), queries))
+    elapsed = time.perf_counter() - started
+
+    recall: dict[str, dict[str, list[float]]] = {}
+    for query, (_, turn) in zip(queries, results):
+        hits = recall.setdefault(query.workload, {name: [] for name in turn["retrieved"]})
+        for name, story_ids in turn["retrieved"].items():
+            hits[name].append(float(query.story_id in story_ids))
+    return {
+        "turns": len(queries),
+        "elapsed_seconds": elapsed,
+        "turns_per_second": len(queries) / elapsed if elapsed else 0.0,
+        "fused_retrieval": search.fused_retrieval,
+        "chunk_index": settings.chunk_top_k > 0,
+        "stages": {stage: percentiles([timings[stage] for timings, _ in results]) for stage in STAGES},
+        "prompt_tokens": percentiles([turn["prompt_tokens"] for _, turn in results]),
+        # Fraction of questions whose own story was retrieved: documents is recall@top_k, story_documents recall@story_top_k,
+        # context whether the prompt quotes it (packed chunks, or the first question-matched story without a chunk index).
+        "recall": {workload: {name: float(np.mean(values)) for name, values in hits.items()} for workload, hits in recall.items()},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def _print_report(results: dict, baseline: dict | None) -> None:
+    ingest = results["ingest"]
+    print(f"ingest: {ingest['stories']} stories, {ingest['questions']} questions in {ingest['elapsed_seconds']:.2f}s "
+          f"({ingest['rows_per_second']:.0f} rows/s, {ingest['embeddings_per_second']:.0f} embeddings/s), "
+          f"commit p95 {ingest['commit_seconds'].get('p95', 0) * 1000:.1f}ms")
+    turns = results["turns"]
+    print(f"turns: {turns['turns']} in {turns['elapsed_seconds']:.2f}s ({turns['turns_per_second']:.1f}/s), "
+          f"fused retrieval {'on' if turns['fused_retrieval'] else 'off'}, chunk index {'on' if turns['chunk_index'] else 'off'}, "
+          f"prompt tokens p50 {turns['prompt_tokens'].get('p50', 0):.0f}, peak RSS {turns['peak_rss_mb'] or 0:.0f}MB")
+
+    print(f"{'stage (ms)':<18}{'p50':>10}{'p95':>10}{'p99':>10}" + (f"{'p50 vs base':>14}{'p95 vs base':>14}" if baseline else ""))
+    for stage, stats in turns["stages"].items():
+        line = f"{stage:<18}" + "".join(f"{stats[p] * 1000:>10.2f}" for p in ("p50", "p95", "p99"))
+        if baseline and stage in baseline["turns"]["stages"]:
+            base = baseline["turns"]["stages"][stage]
+            line += "".join(f"{(stats[p] / base[p] - 1) * 100 if base[p] else 0.0:>+13.1f}%" for p in ("p50", "p95"))
+        print(line)
+
+    for workload, recall in turns["recall"].items():
+        base = baseline["turns"]["recall"].get(workload, {}) if baseline else {}
+        print(f"recall [{workload}]: " + ", ".join(
+            f"{name} {value:.3f}" + (f" (base {base[name]:.3f})" if name in base else "") for name, value in recall.items()
+        ))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark ingestion and chat turns against a local stand-in for IRIS and a stub LLM.")
+    parser.add_argument("--stories", type=int, default=500, help="synthetic stories in addition to the questions.py examples")
+    parser.add_argument("--questions-per-story", type=int, default=5)
+    parser.add_argument("--no-examples", action="store_true", help="leave out the questions.py examples")
+    parser.add_argument("--turns", type=int, default=100, help="chat turns to run; questions are sampled from the corpus")
+    parser.add_argument("--concurrency", type=int, default=1, help="chat turns run at the same time")
+    parser.add_argument("--encoder", choices=("hashing", "model"), default="hashing",
+                        help=f"hashing: offline bag-of-words stand-in; model: {DEFAULT_EMBEDDING_MODEL}")
+    parser.add_argument("--top-k", type=int, default=2)
+    parser.add_argument("--story-top-k", type=int, default=1)
+    parser.add_argument("--chunk-top-k", type=int, default=DEFAULT_CHUNK_TOP_K, help="0 splits retrieved stories per request instead")
+    parser.add_argument("--token-budget", type=int, default=DEFAULT_TOKEN_BUDGET, help="prompt tokens for packed chunks")
+    parser.add_argument("--commit-size", type=int, default=256)
+    parser.add_argument("--llm-first-token", type=float, default=0.25, help="stub LLM time to first token, seconds")
+    parser.add_argument("--llm-tokens", type=int, default=40)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    if args.encoder == "model":
+        from embedding_models import ModelRegistry
+        encoder = ModelRegistry().get(DEFAULT_EMBEDDING_MODEL)
+    else:
+        encoder = HashingEncoder()
+
+    examples = [] if args.no_examples else example_corpus()
+    dataset = examples + synthetic_corpus(args.stories, args.questions_per_story, seed=args.seed)
+    # run_ingest numbers stories by their 1-based position in the dataset.
+    candidates = [
+        Query(question, story_id, "examples" if story_id <= len(examples) else "synthetic")
+        for story_id, story in enumerate(dataset, start=1)
+        for question in story["questions"]
+    ]
+    rng = np.random.default_rng(args.seed)
+    example_queries = [query for query in candidates if query.workload == "examples"]
+    synthetic_queries = [query for query in candidates if query.workload == "synthetic"]
+    sampled = rng.choice(len(synthetic_queries), size=min(len(synthetic_queries), max(0, args.turns - len(example_queries))), replace=False)
+    queries = example_queries[:args.turns] + [synthetic_queries[i] for i in sampled]
+
+    database = StandInIRIS()
+    pool = ConnectionPool(database.connect, max_size=args.pool_size)
+    results = {
+        "config": vars(args),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "timestamp": time.time(), "database": database.directory},
+        "ingest": bench_ingest(dataset, encoder, pool, args.commit_size),
+    }
+
+    search = VectorSearch(pool=pool)
+    llm = StubLLM(args.llm_first_token, args.llm_tokens_per_second, args.llm_tokens)
+    settings = TurnSettings(args.top_k, args.story_top_k, args.chunk_top_k if search.has_chunk_index() else 0, args.token_budget)
+    results["turns"] = bench_turns(queries, encoder, search, llm, settings, args.concurrency)
+    results["pool"] = vars(pool.stats())
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    _print_report(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Offline stand-ins for IRIS, the embedding model and the LLM, used by rag_bench.
+
+StandInIRIS is SQLite with the IRIS dialect the application sends rewritten on the fly:
+RAG_COQA and RAG_Application are attached databases, every table gets an IRIS-style ``ID``
+row id, vectors are float32 blobs ranked by a VECTOR_DOT_PRODUCT function, and ``SELECT
+TOP n`` becomes ``LIMIT n``. Only the statements this application uses are supported.
+"""
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import zlib
+
+from functools import lru_cache
+
+import numpy as np
+
+from vector_codec import EMBEDDING_DIMENSION
+
+SCHEMAS = ("RAG_COQA", "RAG_Application")
+
+_TOP = re.compile(r"\bSELECT\s+TOP\s+(\d+)\s+", re.IGNORECASE)
+_VECTOR_TYPE = re.compile(r"\bVECTOR\s*\(\s*\w+\s*,\s*\d+\s*\)", re.IGNORECASE)
+_TO_VECTOR_PARAMETER = re.compile(r"\bTO_VECTOR\(\s*\?\s*,\s*\w+\s*,\s*\d+\s*\)", re.IGNORECASE)
+_CREATE_TABLE = re.compile(r"(\bCREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?[\w.]+\s*\()", re.IGNORECASE)
+_CREATE_INDEX = re.compile(r"\bCREATE\s+INDEX\s+(IF\s+NOT\s+EXISTS\s+)?(\w+)\s+ON\s+(\w+)\.(\w+)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=256)
+def _parse_vector(text: str) -> bytes:
+    return np.array(text.strip("[]").split(","), dtype=np.float32).tobytes()
+
+
+def _to_vector(value):
+    return _parse_vector(value) if isinstance(value, str) else value
+
+
+def _dot_product(a, b) -> float | None:
+    if a is None or b is None:
+        return None
+    return float(np.dot(np.frombuffer(_to_vector(a), dtype=np.float32), np.frombuffer(_to_vector(b), dtype=np.float32)))
+
+
+def _top_to_limit(sql: str) -> str:
+    # TOP applies to the SELECT it follows, so its LIMIT goes at the end of that SELECT's parentheses.
+    out: list[str] = []
+    pending: list[str | None] = [None]
+    position = 0
+    while position < len(sql):
+        match = _TOP.match(sql, position)
+        if match:
+            if pending[-1] is not None:
+                raise ValueError("Stand-in IRIS supports one SELECT TOP per parenthesised scope")
+            pending[-1] = match.group(1)
+            out.append("SELECT ")
+            position = match.end()
+            continue
+        char = sql[position]
+        if char == "'":
+            end = sql.index("'", position + 1) + 1
+            out.append(sql[position:end])
+            position = end
+            continue
+        if char == "(":
+            pending.append(None)
+        elif char == ")":
+            limit = pending.pop()
+            if limit is not None:
+                out.append(f" LIMIT {limit}")
+        out.append(char)
+        position += 1
+    if pending[-1] is not None:
+        out.append(f" LIMIT {pending[-1]}")
+    return "".join(out)
+
+
+@lru_cache(maxsize=512)
+def translate(sql: str) -> str:
+    """IRIS SQL as used by this application, rewritten for SQLite."""
+    if re.fullmatch(r"\s*START\s+TRANSACTION\s*", sql, re.IGNORECASE):
+        return "BEGIN"
+    sql = _TO_VECTOR_PARAMETER.sub("TO_VECTOR(?)", sql)
+    sql = _VECTOR_TYPE.sub("BLOB", sql)
+    sql = _CREATE_TABLE.sub(r"\1 ID INTEGER PRIMARY KEY,", sql)
+    sql = _CREATE_INDEX.sub(lambda m: f"CREATE INDEX {m.group(1) or ''}{m.group(3)}.{m.group(2)} ON {m.group(4)}", sql)
+    sql = re.sub(r"\bINFORMATION_SCHEMA\.(COLUMNS|TABLES)\b", r"temp.information_schema_\1", sql, flags=re.IGNORECASE)
+    return _top_to_limit(sql)
+
+
+class StandInCursor:
+    def __init__(self, cursor: sqlite3.Cursor) -> None:
+        self._cursor = cursor
+
+    def execute(self, sql: str, parameters=()):
+        self._cursor.execute(translate(sql), parameters)
+        return self
+
+    def executemany(self, sql: str, seq_of_parameters):
+        self._cursor.executemany(translate(sql), seq_of_parameters)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size: int = 1):
+        return self._cursor.fetchmany(size)
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    def close(self) -> None:
+        self._cursor.close()
+
+
+class StandInConnection:
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        self._connection = connection
+
+    def cursor(self) -> StandInCursor:
+        return StandInCursor(self._connection.cursor())
+
+    def commit(self) -> None:
+        self._connection.commit()
+
+    def rollback(self) -> None:
+        self._connection.rollback()
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class StandInIRIS:
+    """A file-backed SQLite database that accepts the application's IRIS SQL.
+
+    ``connect`` is a DB-API connection factory, so it can be handed to ConnectionPool.
+    """
+
+    def __init__(self, directory: str | None = None) -> None:
+        self.directory = directory or tempfile.mkdtemp(prefix="standin_iris_")
+
+    def connect(self) -> StandInConnection:
+        # Autocommit unless a statement starts a transaction, like the IRIS driver.
+        connection = sqlite3.connect(os.path.join(self.directory, "main.db"), timeout=30, isolation_level=None, check_same_thread=False)
+        connection.create_function("TO_VECTOR", 1, _to_vector, deterministic=True)
+        connection.create_function("VECTOR_DOT_PRODUCT", 2, _dot_product, deterministic=True)
+        for schema in SCHEMAS:
+            connection.execute(f"ATTACH DATABASE ? AS {schema}", [os.path.join(self.directory, f"{schema}.db")])
+        columns = " UNION ALL ".join(
+            f"SELECT '{schema}' AS TABLE_SCHEMA, m.name AS TABLE_NAME, c.name AS COLUMN_NAME "
+            f"FROM {schema}.sqlite_master m JOIN pragma_table_info(m.name, '{schema}') c WHERE m.type = 'table'"
+            for schema in SCHEMAS
+        )
+        tables = " UNION ALL ".join(
+            f"SELECT '{schema}' AS TABLE_SCHEMA, name AS TABLE_NAME FROM {schema}.sqlite_master WHERE type = 'table'"
+            for schema in SCHEMAS
+        )
+        connection.execute(f"CREATE TEMP VIEW information_schema_columns AS {columns}")
+        connection.execute(f"CREATE TEMP VIEW information_schema_tables AS {tables}")
+        return StandInConnection(connection)
+
+
+class HashingEncoder:
+    """Deterministic bag-of-words embeddings with the SentenceTransformer.encode interface.
+
+    Texts that share words get similar vectors, which is enough for retrieval recall to mean
+    something without downloading a model.
+    """
+
+    def __init__(self, dimension: int = EMBEDDING_DIMENSION) -> None:
+        self.dimension = dimension
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            bucket = zlib.crc32(word.encode("utf-8"))
+            vector[bucket % self.dimension] += 1.0 if bucket & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs) -> np.ndarray:
+        if isinstance(sentences, str):
+            return self._embed(sentences)
+        return np.stack([self._embed(text) for text in sentences]) if sentences else np.zeros((0, self.dimension), np.float32)
+
+
+class StubChunk:
+    def __init__(self, content: str) -> None:
+        self.content = content
+
+
+class StubLLM:
+    """Streams a canned answer with a fixed time to first token and token rate, like ChatOpenAI.stream."""
+
+    def __init__(self, first_token_seconds: float = 0.25, tokens_per_second: float = 100.0, tokens: int = 40) -> None:
+        self.first_token_seconds = first_token_seconds
+        self.tokens_per_second = tokens_per_second
+        self.tokens = tokens
+
+    def stream(self, prompt: str):
+        time.sleep(self.first_token_seconds)
+        for index in range(self.tokens):
+            if index and self.tokens_per_second:
+                time.sleep(1.0 / self.tokens_per_second)
+            yield StubChunk(f"token{index} ")
@@ -0,0 +1,159 @@
+"""Story chunks, split and embedded at load time into RAG_COQA.StoryChunk.
+
+VectorSearch ranks chunks directly (search_chunks / retrieve_context(chunk_top_k=...)), so a
+chat turn no longer re-splits whole stories. Each chunk row records a hash of the story it was
+cut from; sync_chunks rebuilds the chunks of stories that have none yet or whose text changed.
+
+    python chunking.py            # chunk stories loaded before the chunk table existed
+"""
+import re
+import time
+
+from dataclasses import dataclass
+
+from connection_pool import ConnectionPool, get_pool
+from embedding_models import ModelRegistry
+from embedding_tables import BASE_EMBEDDING_MODEL, content_hash
+from vector_codec import EMBEDDING_DIMENSION, VECTOR_PARAMETER, VECTOR_TYPE, encode_vectors
+
+# Characters per chunk: a few sentences, well inside the embedding models' input limit.
+CHUNK_SIZE = 400
+
+CHUNK_INSERT = f"""INSERT INTO RAG_COQA.StoryChunk (StoryId, ChunkIndex, Chunk, ChunkEmbedding, EmbeddingModel, ContentHash, StoryHash)
+                   VALUES (?,?,?,{VECTOR_PARAMETER},?,?,?)"""
+
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def split_text(text: str, chunk_size: int = CHUNK_SIZE) -> list[str]:
+    """Sentence-aligned chunks of at most ``chunk_size`` characters; longer sentences are cut at spaces."""
+    pieces = []
+    for sentence in _SENTENCE_BREAK.split(text):
+        sentence = sentence.strip()
+        while len(sentence) > chunk_size:
+            cut = sentence.rfind(" ", 0, chunk_size + 1)
+            cut = cut if cut > 0 else chunk_size
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].strip()
+        if sentence:
+            pieces.append(sentence)
+
+    chunks: list[str] = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + 1 + len(piece) > chunk_size:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def create_chunk_table(cursor) -> None:
+    cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS RAG_COQA.StoryChunk (
+                    StoryId INTEGER,
+                    ChunkIndex INTEGER,
+                    Chunk VARCHAR(2000),
+                    ChunkEmbedding VECTOR({VECTOR_TYPE}, {EMBEDDING_DIMENSION}),
+                    EmbeddingModel VARCHAR(200),
+                    ContentHash VARCHAR(64),
+                    StoryHash VARCHAR(64)
+                )
+            """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS StoryChunkStoryIdIdx ON RAG_COQA.StoryChunk (StoryId)")
+
+
+def chunk_rows(model, model_id: str, stories: list[tuple[int, str]], encode_batch_size: int = 64, chunk_size: int = CHUNK_SIZE) -> list[list]:
+    """CHUNK_INSERT rows for (StoryId, story text) pairs, encoded in one batch."""
+    chunks = [(story_id, index, chunk, content_hash(story))
+              for story_id, story in stories
+              for index, chunk in enumerate(split_text(story, chunk_size))]
+    if not chunks:
+        return []
+    embeddings = encode_vectors(model.encode([chunk for _, _, chunk, _ in chunks], batch_size=encode_batch_size))
+    return [
+        [story_id, index, chunk, embedding, model_id, content_hash(chunk), story_hash]
+        for (story_id, index, chunk, story_hash), embedding in zip(chunks, embeddings)
+    ]
+
+
+@dataclass
+class ChunkSyncStats:
+    stories: int = 0
+    chunks: int = 0
+    elapsed_seconds: float = 0.0
+
+
+def sync_chunks(
+    model,
+    pool: ConnectionPool,
+    batch_size: int = 64,
+    encode_batch_size: int = 64,
+    chunk_size: int = CHUNK_SIZE,
+    progress=None,
+) -> ChunkSyncStats:
+    """(Re)build the chunks of stories with no chunks, or whose text changed since they were chunked.
+
+    ``batch_size`` stories are replaced per transaction. ``model`` must be BASE_EMBEDDING_MODEL,
+    whose vectors fill ChunkEmbedding; chunk embeddings of other model generations are then
+    brought up to date by reindex.py --model.
+    """
+    dimension = model.get_sentence_embedding_dimension()
+    if dimension != EMBEDDING_DIMENSION:
+        raise ValueError(f"Chunks are embedded with {BASE_EMBEDDING_MODEL} ({EMBEDDING_DIMENSION} dimensions), got a model with {dimension}; "
+                         "use reindex.py --model for other models")
+    started = time.perf_counter()
+    stats = ChunkSyncStats()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            create_chunk_table(cursor)
+            cursor.execute("SELECT StoryId, Story FROM RAG_COQA.Story")
+            stories = [(story_id, story or "") for story_id, story in cursor.fetchall()]
+            cursor.execute("SELECT DISTINCT StoryId, StoryHash FROM RAG_COQA.StoryChunk")
+            chunked = {story_id: story_hash for story_id, story_hash in cursor.fetchall()}
+            stale = [(story_id, story) for story_id, story in stories if chunked.get(story_id) != content_hash(story)]
+
+            for start in range(0, len(stale), batch_size):
+                batch = stale[start:start + batch_size]
+                rows = chunk_rows(model, BASE_EMBEDDING_MODEL, batch, encode_batch_size, chunk_size)
+                cursor.execute("START TRANSACTION")
+                try:
+                    cursor.executemany("DELETE FROM RAG_COQA.StoryChunk WHERE StoryId = ?", [[story_id] for story_id, _ in batch])
+                    if rows:
+                        cursor.executemany(CHUNK_INSERT, rows)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                stats.stories += len(batch)
+                stats.chunks += len(rows)
+                if progress:
+                    progress(stats.stories, len(stale))
+
+            # Chunks of stories that no longer exist.
+            cursor.execute("DELETE FROM RAG_COQA.StoryChunk WHERE StoryId NOT IN (SELECT StoryId FROM RAG_COQA.Story)")
+            conn.commit()
+        finally:
+            cursor.close()
+    stats.elapsed_seconds = time.perf_counter() - started
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Split and embed stories that have no chunks yet or whose text changed.")
+    parser.add_argument("--batch-size", type=int, default=64, help="stories per transaction")
+    args = parser.parse_args()
+
+    result = sync_chunks(
+        ModelRegistry().get(BASE_EMBEDDING_MODEL),
+        get_pool(),
+        batch_size=args.batch_size,
+        progress=lambda done, total: print(f"{done}/{total} stories chunked"),
+    )
+    print(f"Chunked {result.stories} stories into {result.chunks} chunks in {result.elapsed_seconds:.1f}s")
@@ -0,0 +1,260 @@
+import os
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator
+
+import intersystems_iris.dbapi._DBAPI as iris
+
+from dotenv import find_dotenv, load_dotenv
+
+
+class PoolTimeoutError(TimeoutError):
+    """Raised when no connection becomes available within the pool timeout."""
+
+
+@dataclass
+class PoolStats:
+    size: int
+    idle: int
+    in_use: int
+    checkouts: int
+    created: int
+    reconnects: int
+    discarded: int
+    timeouts: int
+    total_wait_seconds: float
+    max_wait_seconds: float
+
+    @property
+    def avg_wait_seconds(self) -> float:
+        return self.total_wait_seconds / self.checkouts if self.checkouts else 0.0
+
+
+def iris_connection_factory(
+    host: str | None = None,
+    port: int | None = None,
+    namespace: str | None = None,
+    username: str | None = None,
+    password: str | None = None,
+) -> Callable[[], Any]:
+    # Settings are resolved once here, not on every connect.
+    load_dotenv(find_dotenv(usecwd=True), override=True)
+
+    resolved_host = host or os.getenv("IRIS_HOST", "localhost")
+    resolved_port = int(port or os.getenv("IRIS_PORT", "51972"))
+    resolved_namespace = namespace or os.getenv("IRIS_NAMESPACE", "USER")
+    resolved_username = username or os.getenv("IRIS_USERNAME", "SuperUser")
+    resolved_password = password or os.getenv("IRIS_PASSWORD")
+
+    if not resolved_password:
+        raise ValueError("IRIS_PASSWORD is not set (set it in your environment or .env)")
+
+    def connect():
+        return iris.connect(
+            resolved_host,
+            resolved_port,
+            resolved_namespace,
+            resolved_username,
+            resolved_password,
+        )
+
+    return connect
+
+
+class ConnectionPool:
+    """Thread-safe pool of long-lived DB-API connections.
+
+    Connections are created lazily up to ``max_size`` and ``min_size`` of them
+    are opened up front. Idle connections older than ``health_check_interval``
+    seconds are pinged on checkout and transparently replaced if broken.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        min_size: int = 1,
+        max_size: int = 8,
+        timeout: float = 30.0,
+        health_check_interval: float = 30.0,
+    ) -> None:
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min_size={min_size}, max_size={max_size}")
+
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+
+        self._cond = threading.Condition()
+        self._idle: deque[tuple[Any, float]] = deque()
+        self._size = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._created = 0
+        self._reconnects = 0
+        self._discarded = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+        for _ in range(min_size):
+            conn = self._connect()
+            with self._cond:
+                self._size += 1
+                self._created += 1
+                self._idle.append((conn, time.monotonic()))
+
+    def _ping(self, conn) -> bool:
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _close_quietly(self, conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def acquire(self, timeout: float | None = None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        conn = None
+        last_used = 0.0
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(f"No connection available after {timeout:.1f}s (max_size={self.max_size})")
+                self._cond.wait(remaining)
+
+        try:
+            if conn is None:
+                conn = self._connect()
+                with self._cond:
+                    self._created += 1
+            elif time.monotonic() - last_used > self.health_check_interval and not self._ping(conn):
+                self._close_quietly(conn)
+                conn = self._connect()
+                with self._cond:
+                    self._reconnects += 1
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._checkouts += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+        return conn
+
+    def release(self, conn, broken: bool = False) -> None:
+        with self._cond:
+            if broken or self._closed:
+                self._size -= 1
+                self._discarded += broken
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if broken or self._closed:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self, timeout: float | None = None) -> Iterator[Any]:
+        conn = self.acquire(timeout)
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            # The driver doesn't tell us whether an error killed the connection, so check before reuse.
+            broken = not self._ping(conn)
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    @contextmanager
+    def cursor(self, timeout: float | None = None) -> Iterator[Any]:
+        with self.connection(timeout) as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def stats(self) -> PoolStats:
+        with self._cond:
+            return PoolStats(
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                checkouts=self._checkouts,
+                created=self._created,
+                reconnects=self._reconnects,
+                discarded=self._discarded,
+                timeouts=self._timeouts,
+                total_wait_seconds=self._total_wait,
+                max_wait_seconds=self._max_wait,
+            )
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._size -= len(idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+
+_pools: dict[tuple, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(
+    host: str | None = None,
+    port: int | None = None,
+    namespace: str | None = None,
+    username: str | None = None,
+    password: str | None = None,
+) -> ConnectionPool:
+    """Return the process-wide pool for these settings, creating it on first use."""
+    key = (host, port, namespace, username)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            connect = iris_connection_factory(host, port, namespace, username, password)
+            pool = ConnectionPool(
+                connect,
+                min_size=int(os.getenv("IRIS_POOL_MIN_SIZE", "1")),
+                max_size=int(os.getenv("IRIS_POOL_MAX_SIZE", "8")),
+                timeout=float(os.getenv("IRIS_POOL_TIMEOUT", "30")),
+            )
+            _pools[key] = pool
+        return pool
@@ -0,0 +1,345 @@
+"""Chat history in IRIS, written behind the chat turn in batches.
+
+    store = ConversationStore(get_pool())
+    conversation_id = store.start_conversation("alice", "Storms in 2018")
+    store.append_turn("alice", conversation_id, 0, prompt, response)
+    store.save_summary(conversation_id, memory.buffer, summary_turns=1)
+    store.turns("alice", conversation_id)  # the latest page of turns, oldest first
+
+Writes are queued and committed by one writer thread, ``batch_size`` rows or ``flush_interval``
+seconds at a time. Each conversation's turn count and summary are coalesced, so only the latest
+value is written per batch. Reads are parameterized and paginated by key, not by offset:
+conversations by (Username, UpdatedAt) and turns by (Username, ConversationId, TurnIndex),
+which are both indexed, so lookups stay fast as the tables grow.
+
+The summary is the ConversationSummaryMemory buffer along with the number of turns it covers.
+A resumed conversation restores it instead of replaying every message through the LLM.
+"""
+import logging
+import threading
+import time
+import uuid
+
+from dataclasses import dataclass
+
+from connection_pool import ConnectionPool
+from tracing import get_tracer
+
+logger = logging.getLogger(__name__)
+
+# Turns per page when a conversation is resumed or scrolled back.
+HISTORY_PAGE_SIZE = 50
+
+# Column sizes of the tables below; longer values are truncated rather than failing their batch.
+USERNAME_LENGTH = 100
+TITLE_LENGTH = 250
+MESSAGE_LENGTH = 10000
+SUMMARY_LENGTH = 32000
+
+CONVERSATION_INSERT = """INSERT INTO RAG_Application.Conversation (ConversationId, Username, Title, Turns, SummaryTurns, CreatedAt, UpdatedAt)
+                         VALUES (?,?,?,0,0,?,?)"""
+TURN_INSERT = """INSERT INTO RAG_Application.ConversationTurn (ConversationId, Username, TurnIndex, HumanMessage, AIMessage, CreatedAt)
+                 VALUES (?,?,?,?,?,?)"""
+TURNS_UPDATE = "UPDATE RAG_Application.Conversation SET Turns = ?, UpdatedAt = ? WHERE ConversationId = ?"
+SUMMARY_UPDATE = "UPDATE RAG_Application.Conversation SET Summary = ?, SummaryTurns = ? WHERE ConversationId = ?"
+
+
+@dataclass
+class Conversation:
+    conversation_id: str
+    title: str
+    turns: int
+    summary: str
+    summary_turns: int  # turns 0 .. summary_turns - 1 are covered by the summary
+    created_at: float
+    updated_at: float
+
+
+@dataclass
+class ConversationTurn:
+    turn_index: int
+    human_message: str
+    ai_message: str
+    created_at: float
+
+
+@dataclass
+class ConversationStoreStats:
+    pending: int
+    turns_written: int
+    batches: int
+    failed_batches: int
+    set_aside_rows: int
+    last_batch_seconds: float
+    last_error: str | None  # of the most recent failed batch, even if a retry has succeeded since
+
+
+def create_conversation_tables(cursor) -> None:
+    cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS RAG_Application.Conversation (
+                    ConversationId VARCHAR(36),
+                    Username VARCHAR({USERNAME_LENGTH}),
+                    Title VARCHAR({TITLE_LENGTH}),
+                    Turns INTEGER,
+                    Summary VARCHAR({SUMMARY_LENGTH}),
+                    SummaryTurns INTEGER,
+                    CreatedAt DOUBLE,
+                    UpdatedAt DOUBLE
+                )
+            """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS ConversationIdIdx ON RAG_Application.Conversation (ConversationId)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ConversationUserIdx ON RAG_Application.Conversation (Username, UpdatedAt)")
+    cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS RAG_Application.ConversationTurn (
+                    ConversationId VARCHAR(36),
+                    Username VARCHAR({USERNAME_LENGTH}),
+                    TurnIndex INTEGER,
+                    HumanMessage VARCHAR({MESSAGE_LENGTH}),
+                    AIMessage VARCHAR({MESSAGE_LENGTH}),
+                    CreatedAt DOUBLE
+                )
+            """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS ConversationTurnIdx ON RAG_Application.ConversationTurn (Username, ConversationId, TurnIndex)")
+
+
+class ConversationStore:
+    """Persists conversations and their turns without blocking the chat turn (see the module docstring).
+
+    A failed batch is rolled back and retried after ``retry_seconds``, ahead of anything queued
+    since. After ``max_attempts`` failures it is moved to ``set_aside`` so later writes aren't
+    held up behind it. ``flush`` raises a failure to its caller; ``stats`` reports it.
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        batch_size: int = 256,
+        flush_interval: float = 0.5,
+        retry_seconds: float = 5.0,
+        max_attempts: int = 3,
+    ) -> None:
+        self.pool = pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_seconds = retry_seconds
+        self.max_attempts = max_attempts
+        # Batches given up on, as (conversations, turns, turn counts, summaries); kept for inspection, not retried.
+        self.set_aside: list[tuple] = []
+        with self.pool.cursor() as iris_cursor:
+            create_conversation_tables(iris_cursor)
+
+        # Pending writes, committed in this order: new conversations, turns, then the latest turn count and summary per conversation.
+        self._conversations: list[list] = []
+        self._turns: list[list] = []
+        self._turn_counts: dict[str, list] = {}
+        self._summaries: dict[str, list] = {}
+        self._condition = threading.Condition()
+        self._writing = False
+        self._flush_requested = False
+        self._closed = False
+        self._turns_written = 0
+        self._batches = 0
+        self._failed_batches = 0
+        self._attempts = 0  # consecutive failures of the batch at the front of the queue
+        self._last_batch_seconds = 0.0
+        self._last_error: BaseException | None = None
+        self._writer = threading.Thread(target=self._run, name="conversation-store", daemon=True)
+        self._writer.start()
+
+    def _pending(self) -> int:
+        return len(self._conversations) + len(self._turns) + len(self._turn_counts) + len(self._summaries)
+
+    def start_conversation(self, username: str, title: str) -> str:
+        conversation_id = uuid.uuid4().hex
+        now = time.time()
+        with self._condition:
+            self._conversations.append([conversation_id, username[:USERNAME_LENGTH], title[:TITLE_LENGTH], now, now])
+            self._condition.notify_all()
+        return conversation_id
+
+    def append_turn(self, username: str, conversation_id: str, turn_index: int, human_message: str, ai_message: str) -> None:
+        now = time.time()
+        with self._condition:
+            self._turns.append([conversation_id, username[:USERNAME_LENGTH], turn_index,
+                                human_message[:MESSAGE_LENGTH], ai_message[:MESSAGE_LENGTH], now])
+            self._turn_counts[conversation_id] = [turn_index + 1, now, conversation_id]
+            self._condition.notify_all()
+
+    def save_summary(self, conversation_id: str, summary: str, summary_turns: int) -> None:
+        with self._condition:
+            self._summaries[conversation_id] = [summary[:SUMMARY_LENGTH], summary_turns, conversation_id]
+            self._condition.notify_all()
+
+    def flush(self, timeout: float | None = None) -> None:
+        """Wait until every write queued so far is committed; raises if a batch fails meanwhile."""
+        if not self._drain(timeout):
+            raise self._last_error
+        if self._pending() or self._writing:
+            raise TimeoutError(f"{self._pending()} conversation writes still pending after {timeout}s")
+
+    def _drain(self, timeout: float | None = None) -> bool:
+        # Waits for the queued writes, until one fails or the timeout passes. False if a batch failed.
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            failures = self._failed_batches
+            self._flush_requested = True
+            self._condition.notify_all()
+            while (self._pending() or self._writing) and self._failed_batches == failures:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return self._failed_batches == failures
+
+    def _read_your_writes(self) -> None:
+        # Reads wait for queued writes so they include them, but don't wait out (or fail on) a batch being retried.
+        with self._condition:
+            retrying = self._attempts > 0
+        if not retrying:
+            self._drain(timeout=self.flush_interval + 5.0)
+
+    def close(self) -> None:
+        """Commit what is queued, then stop the writer."""
+        try:
+            self.flush()
+        finally:
+            with self._condition:
+                self._closed = True
+                self._condition.notify_all()
+            self._writer.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending() and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                # Let more writes join the batch, unless it is full or someone is waiting for it.
+                deadline = time.monotonic() + self.flush_interval
+                while self._pending() < self.batch_size and not self._flush_requested and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = (self._conversations, self._turns, self._turn_counts, self._summaries)
+                self._conversations, self._turns, self._turn_counts, self._summaries = [], [], {}, {}
+                self._flush_requested = False
+                self._writing = True
+
+            started = time.perf_counter()
+            try:
+                self._write(*batch)
+            except Exception as error:
+                with self._condition:
+                    self._failed_batches += 1
+                    self._attempts += 1
+                    self._last_error = error
+                    if self._attempts >= self.max_attempts:
+                        logger.error("Setting aside a conversation history batch of %d rows after %d failed attempts: %r",
+                                     sum(map(len, batch)), self._attempts, error)
+                        self.set_aside.append(batch)
+                        self._attempts = 0
+                    else:
+                        logger.warning("Writing conversation history failed (attempt %d of %d), retrying: %r",
+                                       self._attempts, self.max_attempts, error)
+                        # Keep the batch ahead of anything queued since; newer counts and summaries win.
+                        self._conversations = batch[0] + self._conversations
+                        self._turns = batch[1] + self._turns
+                        self._turn_counts = {**batch[2], **self._turn_counts}
+                        self._summaries = {**batch[3], **self._summaries}
+                    self._writing = False
+                    self._condition.notify_all()
+                    retry_at = time.monotonic() + self.retry_seconds
+                    while not self._closed and (remaining := retry_at - time.monotonic()) > 0:
+                        self._condition.wait(remaining)
+                continue
+            with self._condition:
+                self._turns_written += len(batch[1])
+                self._batches += 1
+                self._attempts = 0
+                self._last_batch_seconds = time.perf_counter() - started
+                self._writing = False
+                self._condition.notify_all()
+
+    def _write(self, conversations: list, turns: list, turn_counts: dict, summaries: dict) -> None:
+        rows = len(conversations) + len(turns) + len(turn_counts) + len(summaries)
+        with get_tracer().span("conversation_store.write", rows=rows):
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute("START TRANSACTION")
+                    try:
+                        if conversations:
+                            cursor.executemany(CONVERSATION_INSERT, conversations)
+                        if turns:
+                            cursor.executemany(TURN_INSERT, turns)
+                        if turn_counts:
+                            cursor.executemany(TURNS_UPDATE, list(turn_counts.values()))
+                        if summaries:
+                            cursor.executemany(SUMMARY_UPDATE, list(summaries.values()))
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                finally:
+                    cursor.close()
+
+    def conversations(self, username: str, limit: int = 20, updated_before: float | None = None) -> list[Conversation]:
+        """``username``'s conversations, most recently updated first.
+
+        Pass the last one's ``updated_at`` as ``updated_before`` for the next page. Doesn't wait
+        for queued writes, so a conversation can show up (or move up) ``flush_interval`` late.
+        """
+        query = f"""SELECT TOP {int(limit)} ConversationId, Title, Turns, Summary, SummaryTurns, CreatedAt, UpdatedAt
+                    FROM RAG_Application.Conversation
+                    WHERE Username = ?{" AND UpdatedAt < ?" if updated_before is not None else ""}
+                    ORDER BY UpdatedAt DESC"""
+        parameters = [username[:USERNAME_LENGTH]] + ([] if updated_before is None else [updated_before])
+        with get_tracer().span("conversation_store.conversations") as span:
+            with self.pool.cursor() as iris_cursor:
+                iris_cursor.execute(query, parameters)
+                rows = iris_cursor.fetchall()
+            span.set(rows=len(rows))
+        return [Conversation(row[0], row[1], row[2] or 0, row[3] or "", row[4] or 0, row[5], row[6]) for row in rows]
+
+    def conversation(self, username: str, conversation_id: str) -> Conversation | None:
+        self._read_your_writes()
+        with self.pool.cursor() as iris_cursor:
+            iris_cursor.execute("""SELECT ConversationId, Title, Turns, Summary, SummaryTurns, CreatedAt, UpdatedAt
+                                   FROM RAG_Application.Conversation
+                                   WHERE ConversationId = ? AND Username = ?""", [conversation_id, username[:USERNAME_LENGTH]])
+            row = iris_cursor.fetchone()
+        return None if row is None else Conversation(row[0], row[1], row[2] or 0, row[3] or "", row[4] or 0, row[5], row[6])
+
+    def turns(self, username: str, conversation_id: str, before_turn: int | None = None, limit: int = HISTORY_PAGE_SIZE) -> list[ConversationTurn]:
+        """Up to ``limit`` turns before ``before_turn`` (default: the latest turns), oldest first.
+
+        Pass the first returned turn's index as ``before_turn`` to page further back. Queued
+        writes are committed first, so every turn appended before the call is included (unless
+        a batch is failing; the read then goes ahead without it).
+        """
+        self._read_your_writes()
+        query = f"""SELECT TOP {int(limit)} TurnIndex, HumanMessage, AIMessage, CreatedAt
+                    FROM RAG_Application.ConversationTurn
+                    WHERE Username = ? AND ConversationId = ?{" AND TurnIndex < ?" if before_turn is not None else ""}
+                    ORDER BY TurnIndex DESC"""
+        parameters = [username[:USERNAME_LENGTH], conversation_id] + ([] if before_turn is None else [before_turn])
+        with get_tracer().span("conversation_store.turns") as span:
+            with self.pool.cursor() as iris_cursor:
+                iris_cursor.execute(query, parameters)
+                rows = iris_cursor.fetchall()
+            span.set(rows=len(rows))
+        return [ConversationTurn(*row) for row in reversed(rows)]
+
+    def stats(self) -> ConversationStoreStats:
+        with self._condition:
+            return ConversationStoreStats(
+                pending=self._pending(),
+                turns_written=self._turns_written,
+                batches=self._batches,
+                failed_batches=self._failed_batches,
+                set_aside_rows=sum(sum(map(len, batch)) for batch in self.set_aside),
+                last_batch_seconds=self._last_batch_seconds,
+                last_error=None if self._last_error is None else repr(self._last_error),
+            )
@@ -0,0 +1,153 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from sentence_transformers import SentenceTransformer
+
+from embedding_tables import BASE_EMBEDDING_MODEL
+from tracing import get_tracer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = BASE_EMBEDDING_MODEL
+
+# Output dimension of the models offered in the app, so it is known before the model is loaded.
+KNOWN_DIMENSIONS = {
+    "avsolatorio/GIST-Embedding-v0": 768,
+    "all-MiniLM-L6-v2": 384,
+}
+
+HUGGINGFACE_CACHE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "huggingface_cache")
+
+
+def normalize_text(text: str) -> str:
+    # Whitespace-only differences don't change the meaning, but would otherwise miss the cache.
+    return " ".join(text.split())
+
+
+class ModelRegistry:
+    """Loads each SentenceTransformer at most once per process, on first use."""
+
+    def __init__(self, cache_folder: str = HUGGINGFACE_CACHE_FOLDER) -> None:
+        self.cache_folder = cache_folder
+        self._models: dict[str, SentenceTransformer] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> SentenceTransformer:
+        model = self._models.get(name)
+        if model is None:
+            with self._lock:
+                model = self._models.get(name)
+                if model is None:
+                    model = SentenceTransformer(name, cache_folder=self.cache_folder)
+                    # The first encode pays for lazy initialisation (tokenizer, kernels); do it now, not on a user's prompt.
+                    model.encode("warm up")
+                    self._models[name] = model
+        return model
+
+    def dimension(self, name: str) -> int:
+        if name in KNOWN_DIMENSIONS:
+            return KNOWN_DIMENSIONS[name]
+        return self.get(name).get_sentence_embedding_dimension()
+
+
+@dataclass
+class EmbeddingCacheStats:
+    size: int
+    hits: int
+    disk_hits: int
+    misses: int
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.disk_hits + self.misses
+        return (self.hits + self.disk_hits) / lookups if lookups else 0.0
+
+
+class EmbeddingCache:
+    """LRU cache of query embeddings keyed by (model, normalized text), with an optional on-disk tier.
+
+    Cached arrays are shared between callers and marked read-only.
+    """
+
+    def __init__(self, registry: ModelRegistry, max_size: int = 1024, directory: str | None = None) -> None:
+        self.registry = registry
+        self.max_size = max_size
+        self.directory = directory
+        self._entries: OrderedDict[tuple[str, str], np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self.tracer = get_tracer()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _disk_path(self, key: tuple[str, str]) -> str:
+        digest = hashlib.sha256("\0".join(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.npy")
+
+    def _remember(self, key: tuple[str, str], embedding: np.ndarray) -> None:
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def encode(self, text: str, model_name: str = DEFAULT_EMBEDDING_MODEL) -> np.ndarray:
+        with self.tracer.span("embedding.encode", model=model_name, chars=len(text)) as span:
+            embedding, source = self._encode(normalize_text(text), model_name)
+            span.set(source=source)
+        return embedding
+
+    def _encode(self, text: str, model_name: str) -> tuple[np.ndarray, str]:
+        key = (model_name, text)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return embedding, "memory"
+
+        if self.directory and os.path.exists(self._disk_path(key)):
+            embedding = np.load(self._disk_path(key))
+            embedding.flags.writeable = False
+            with self._lock:
+                self._disk_hits += 1
+            self._remember(key, embedding)
+            return embedding, "disk"
+
+        embedding = self.registry.get(model_name).encode(text)
+        embedding.flags.writeable = False
+        with self._lock:
+            self._misses += 1
+        self._remember(key, embedding)
+        if self.directory:
+            self._save(key, embedding)
+        return embedding, "model"
+
+    def _save(self, key: tuple[str, str], embedding: np.ndarray) -> None:
+        # Each writer gets its own temp file, so concurrent misses for the same text just replace each other.
+        # The disk tier is an optimization: a failed write is logged, never raised into the caller.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".npy.tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, embedding, allow_pickle=False)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError as error:
+            logger.warning("Could not write embedding to the disk cache: %r", error)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def stats(self) -> EmbeddingCacheStats:
+        with self._lock:
+            return EmbeddingCacheStats(size=len(self._entries), hits=self._hits, disk_hits=self._disk_hits, misses=self._misses)
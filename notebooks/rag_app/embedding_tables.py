@@ -0,0 +1,146 @@
+import hashlib
+import re
+
+from dataclasses import dataclass
+
+from vector_codec import EMBEDDING_DIMENSION, VECTOR_TYPE
+
+# The model whose vectors live in the StoryEmbedding / QuestionEmbedding columns of
+# RAG_COQA.Story and RAG_COQA.QandA. Every other model generation gets its own pair of
+# side tables (see generation_tables), so it can be backfilled while queries use the base columns.
+BASE_EMBEDDING_MODEL = "avsolatorio/GIST-Embedding-v0"
+
+READY = "ready"
+BACKFILLING = "backfilling"
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def table_suffix(model_id: str) -> str:
+    return re.sub(r"\W+", "_", model_id).strip("_")
+
+
+@dataclass(frozen=True)
+class EmbeddingColumns:
+    """Where one model's vectors are stored, as SQL fragments for VectorSearch's queries.
+
+    Stories are always read from ``RAG_COQA.Story data``; ``story_join`` adds the side table
+    when the vectors aren't in that row. ``question_table`` is joined as ``vector`` on StoryID.
+    Chunks are read from ``RAG_COQA.StoryChunk chunk``, with ``chunk_join`` like ``story_join``.
+    """
+    model_id: str
+    dimension: int
+    story_table: str
+    question_table: str
+    chunk_table: str
+    story_join: str
+    chunk_join: str
+    story_vector: str
+    question_vector: str
+    chunk_vector: str
+
+
+def embedding_columns(model_id: str = BASE_EMBEDDING_MODEL, dimension: int = EMBEDDING_DIMENSION) -> EmbeddingColumns:
+    if model_id == BASE_EMBEDDING_MODEL:
+        return EmbeddingColumns(
+            model_id=model_id,
+            dimension=EMBEDDING_DIMENSION,
+            story_table="RAG_COQA.Story",
+            question_table="RAG_COQA.QandA",
+            chunk_table="RAG_COQA.StoryChunk",
+            story_join="",
+            chunk_join="",
+            story_vector="TO_VECTOR(data.StoryEmbedding)",
+            question_vector="TO_VECTOR(vector.QuestionEmbedding)",
+            chunk_vector="TO_VECTOR(chunk.ChunkEmbedding)",
+        )
+    suffix = table_suffix(model_id)
+    return EmbeddingColumns(
+        model_id=model_id,
+        dimension=dimension,
+        story_table=f"RAG_COQA.StoryEmbedding_{suffix}",
+        question_table=f"RAG_COQA.QandAEmbedding_{suffix}",
+        chunk_table=f"RAG_COQA.StoryChunkEmbedding_{suffix}",
+        story_join=f"JOIN RAG_COQA.StoryEmbedding_{suffix} emb ON emb.StoryId = data.StoryId",
+        chunk_join=f"JOIN RAG_COQA.StoryChunkEmbedding_{suffix} cemb ON cemb.ChunkId = chunk.ID",
+        story_vector="emb.Embedding",
+        question_vector="vector.Embedding",
+        chunk_vector="cemb.Embedding",
+    )
+
+
+def _existing_columns(cursor, table: str) -> set[str]:
+    cursor.execute(
+        "SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_SCHEMA = 'RAG_COQA' AND TABLE_NAME = ?",
+        [table],
+    )
+    return {row[0].lower() for row in cursor.fetchall()}
+
+
+def create_metadata_columns(cursor) -> None:
+    """Add EmbeddingModel / ContentHash to base tables created before they were tracked."""
+    for table in ("Story", "QandA"):
+        existing = _existing_columns(cursor, table)
+        if "embeddingmodel" not in existing:
+            cursor.execute(f"ALTER TABLE RAG_COQA.{table} ADD EmbeddingModel VARCHAR(200)")
+        if "contenthash" not in existing:
+            cursor.execute(f"ALTER TABLE RAG_COQA.{table} ADD ContentHash VARCHAR(64)")
+
+
+def create_generation_tables(cursor, model_id: str, dimension: int) -> EmbeddingColumns:
+    columns = embedding_columns(model_id, dimension)
+    cursor.execute("""
+                CREATE TABLE IF NOT EXISTS RAG_COQA.EmbeddingModel (
+                    ModelId VARCHAR(200),
+                    Dimension INTEGER,
+                    Status VARCHAR(20)
+                )
+            """)
+    if model_id == BASE_EMBEDDING_MODEL:
+        return columns
+    cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {columns.story_table} (
+                    StoryId INTEGER,
+                    ContentHash VARCHAR(64),
+                    Embedding VECTOR({VECTOR_TYPE}, {dimension})
+                )
+            """)
+    cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {columns.question_table} (
+                    QandAId INTEGER,
+                    StoryId INTEGER,
+                    ContentHash VARCHAR(64),
+                    Embedding VECTOR({VECTOR_TYPE}, {dimension})
+                )
+            """)
+    cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {columns.chunk_table} (
+                    ChunkId INTEGER,
+                    StoryId INTEGER,
+                    ContentHash VARCHAR(64),
+                    Embedding VECTOR({VECTOR_TYPE}, {dimension})
+                )
+            """)
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS StoryIdIdx ON {columns.story_table} (StoryId)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS QandAIdIdx ON {columns.question_table} (QandAId)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS ChunkIdIdx ON {columns.chunk_table} (ChunkId)")
+    return columns
+
+
+def set_generation_status(cursor, model_id: str, dimension: int, status: str) -> None:
+    cursor.execute("DELETE FROM RAG_COQA.EmbeddingModel WHERE ModelId = ?", [model_id])
+    cursor.execute("INSERT INTO RAG_COQA.EmbeddingModel (ModelId, Dimension, Status) VALUES (?, ?, ?)", [model_id, dimension, status])
+
+
+def ready_generations(cursor) -> dict[str, int]:
+    """Models whose embeddings are complete and can be queried, mapped to their dimension."""
+    cursor.execute(
+        "SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = 'RAG_COQA' AND TABLE_NAME = 'EmbeddingModel'"
+    )
+    generations = {BASE_EMBEDDING_MODEL: EMBEDDING_DIMENSION}
+    if cursor.fetchone()[0]:
+        cursor.execute("SELECT ModelId, Dimension FROM RAG_COQA.EmbeddingModel WHERE Status = ?", [READY])
+        generations.update({model_id: dimension for model_id, dimension in cursor.fetchall()})
+    return generations
@@ -0,0 +1,308 @@
+"""Load the CoQA dataset into RAG_COQA.Story, RAG_COQA.QandA and RAG_COQA.StoryChunk.
+
+Replaces the row-at-a-time loop in data_loader.ipynb. Stories are encoded in large
+cross-story batches on the calling thread while a writer thread inserts the previous
+batches with executemany, one transaction per commit batch. Progress is checkpointed
+after every commit, so an interrupted run picks up where it stopped; rows of a batch that
+was committed but not yet checkpointed are deleted and loaded again.
+
+    python ingest.py --split train                 # the whole split
+    python ingest.py --limit 300                   # the notebook's demo subset
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+from dataclasses import dataclass
+from itertools import islice
+
+from datasets import load_dataset
+
+from chunking import CHUNK_INSERT, chunk_rows, create_chunk_table
+from connection_pool import ConnectionPool, get_pool
+from embedding_models import ModelRegistry
+from embedding_tables import BASE_EMBEDDING_MODEL, content_hash, create_metadata_columns
+from tracing import bind_context, get_tracer
+from vector_codec import EMBEDDING_DIMENSION, VECTOR_PARAMETER, VECTOR_TYPE, encode_vectors
+
+REPO_ID = "stanfordnlp/coqa"
+DEFAULT_CHECKPOINT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ingest_checkpoint.json")
+
+STORY_INSERT = f"INSERT INTO RAG_COQA.Story (StoryId, Source, Story, StoryEmbedding, EmbeddingModel, ContentHash) VALUES (?,?,?,{VECTOR_PARAMETER},?,?)"
+QANDA_INSERT = f"INSERT INTO RAG_COQA.QandA (StoryId, Question, QuestionEmbedding, Answer, EmbeddingModel, ContentHash) VALUES (?,?,{VECTOR_PARAMETER},?,?,?)"
+
+
+def create_tables(cursor) -> None:
+    cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS RAG_COQA.Story (
+                    StoryId INTEGER,
+                    Source VARCHAR(50),
+                    Story VARCHAR(10000),
+                    StoryEmbedding VECTOR({VECTOR_TYPE}, {EMBEDDING_DIMENSION}),
+                    EmbeddingModel VARCHAR(200),
+                    ContentHash VARCHAR(64)
+                )
+            """)
+    cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS RAG_COQA.QandA (
+                    StoryId INTEGER,
+                    Question VARCHAR(500),
+                    QuestionEmbedding VECTOR({VECTOR_TYPE}, {EMBEDDING_DIMENSION}),
+                    Answer VARCHAR(1000),
+                    EmbeddingModel VARCHAR(200),
+                    ContentHash VARCHAR(64)
+                )
+            """)
+    # Tables created by earlier versions of the loader lack the embedding metadata columns.
+    create_metadata_columns(cursor)
+    create_chunk_table(cursor)
+
+
+# Tables of other model generations (see embedding_tables.py), named <prefix><model suffix>.
+GENERATION_TABLE_PREFIXES = ("storyembedding_", "qandaembedding_", "storychunkembedding_")
+
+
+def drop_tables(cursor) -> list[str]:
+    """Drop the loaded corpus, returning the dropped table names.
+
+    That is Story, QandA and StoryChunk, every model generation's side tables and the
+    EmbeddingModel registry, so a reload doesn't mix with chunks or vectors of the old corpus.
+    """
+    cursor.execute("SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = 'RAG_COQA'")
+    dropped = [name for (name,) in cursor.fetchall()
+               if name.lower() in ("story", "qanda", "storychunk", "embeddingmodel") or name.lower().startswith(GENERATION_TABLE_PREFIXES)]
+    for name in dropped:
+        cursor.execute(f"DROP TABLE RAG_COQA.{name}")
+    return dropped
+
+
+@dataclass
+class IngestStats:
+    stories: int = 0
+    questions: int = 0
+    chunks: int = 0
+    embeddings: int = 0
+    encode_seconds: float = 0.0
+    write_seconds: float = 0.0
+    elapsed_seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return (self.stories + self.questions + self.chunks) / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    @property
+    def embeddings_per_second(self) -> float:
+        return self.embeddings / self.encode_seconds if self.encode_seconds else 0.0
+
+
+def _load_checkpoint(path: str, split: str) -> dict | None:
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    return checkpoint if checkpoint.get("split") == split else None
+
+
+def read_checkpoint(path: str, split: str) -> int:
+    """Index of the next story to load, or 0 when there is no checkpoint for this split."""
+    checkpoint = _load_checkpoint(path, split)
+    return checkpoint["next_index"] if checkpoint else 0
+
+
+def write_checkpoint(path: str, split: str, next_index: int) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"split": split, "next_index": next_index}, f)
+    os.replace(tmp_path, path)
+
+
+def delete_stories_after(cursor, story_id: int) -> None:
+    for table in ("RAG_COQA.Story", "RAG_COQA.QandA", "RAG_COQA.StoryChunk"):
+        cursor.execute(f"DELETE FROM {table} WHERE StoryId > ?", [story_id])
+
+
+def _encode_batch(model, model_id: str, batch: list[tuple[int, dict]], encode_batch_size: int) -> tuple[list, list, list]:
+    stories = [story for _, story in batch]
+    story_embeddings = encode_vectors(model.encode([story["story"] for story in stories], batch_size=encode_batch_size))
+
+    questions, answers, story_ids = [], [], []
+    for story_id, story in batch:
+        story_questions = list(story["questions"])
+        questions.extend(story_questions)
+        answers.extend(story["answers"]["input_text"][:len(story_questions)])
+        story_ids.extend([story_id] * len(story_questions))
+    question_embeddings = encode_vectors(model.encode(questions, batch_size=encode_batch_size)) if questions else []
+
+    # Hashes are of the text as stored, which is what reindex.py compares against.
+    story_rows = [
+        [story_id, story["source"][0:50], story["story"][0:10000], embedding, model_id, content_hash(story["story"][0:10000])]
+        for (story_id, story), embedding in zip(batch, story_embeddings)
+    ]
+    qanda_rows = [
+        [story_id, question[0:500], embedding, answer[0:999], model_id, content_hash(question[0:500])]
+        for story_id, question, embedding, answer in zip(story_ids, questions, question_embeddings, answers)
+    ]
+    chunks = chunk_rows(model, model_id, [(story_id, story["story"][0:10000]) for story_id, story in batch], encode_batch_size)
+    return story_rows, qanda_rows, chunks
+
+
+def run_ingest(
+    dataset,
+    model,
+    pool: ConnectionPool,
+    split: str = "train",
+    limit: int | None = None,
+    encode_batch_size: int = 64,
+    commit_size: int = 256,
+    checkpoint_path: str | None = DEFAULT_CHECKPOINT,
+    progress=None,
+) -> IngestStats:
+    """Encode and insert ``dataset`` (an iterable of CoQA stories), resuming from the checkpoint.
+
+    ``commit_size`` is the number of stories per transaction; ``progress`` is called with the
+    running IngestStats after each commit. StoryId is the 1-based position in the split, so a
+    resumed run continues the same numbering.
+
+    ``model`` must be BASE_EMBEDDING_MODEL: its vectors fill the base embedding columns, which
+    VectorSearch ranks as that model's. Other models are added next to it with reindex.py --model.
+    """
+    dimension = model.get_sentence_embedding_dimension()
+    if dimension != EMBEDDING_DIMENSION:
+        raise ValueError(f"ingest.py loads {BASE_EMBEDDING_MODEL} embeddings ({EMBEDDING_DIMENSION} dimensions), got a model with {dimension}; "
+                         "use reindex.py --model for other models")
+    with get_tracer().trace("ingest", split=split, model=BASE_EMBEDDING_MODEL) as trace:
+        stats = _run_ingest(dataset, model, pool, split, BASE_EMBEDDING_MODEL, limit, encode_batch_size, commit_size, checkpoint_path, progress)
+        trace.set(stories=stats.stories, questions=stats.questions, chunks=stats.chunks)
+    return stats
+
+
+def _run_ingest(dataset, model, pool, split, model_id, limit, encode_batch_size, commit_size, checkpoint_path, progress) -> IngestStats:
+    tracer = get_tracer()
+    start_index = read_checkpoint(checkpoint_path, split)
+    # Written up front, so a run interrupted during its first batch also resumes (and cleans up) from here.
+    if checkpoint_path and _load_checkpoint(checkpoint_path, split) is None:
+        write_checkpoint(checkpoint_path, split, start_index)
+    stop_index = len(dataset) if limit is None else min(limit, len(dataset))
+    stats = IngestStats()
+    started = time.perf_counter()
+
+    # Bounded, so encoding runs at most a couple of batches ahead of the database.
+    batches: queue.Queue = queue.Queue(maxsize=2)
+    writer_error: list[BaseException] = []
+
+    def write() -> None:
+        try:
+            with pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    create_tables(cursor)
+                    # StoryId is the position in the split, so anything past the starting point is about to be
+                    # inserted again: a batch committed but not checkpointed, or an earlier run (--restart, or
+                    # tables loaded without this checkpoint file).
+                    cursor.execute("START TRANSACTION")
+                    try:
+                        delete_stories_after(cursor, start_index)
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    while (item := batches.get()) is not None:
+                        next_index, story_rows, qanda_rows, chunks = item
+                        write_start = time.perf_counter()
+                        payload_bytes = (sum(len(row[3]) for row in story_rows) + sum(len(row[2]) for row in qanda_rows)
+                                         + sum(len(row[3]) for row in chunks))
+                        with tracer.span("ingest.write", rows=len(story_rows) + len(qanda_rows) + len(chunks), payload_bytes=payload_bytes):
+                            # One transaction per batch: a crash never leaves a half-written batch behind the checkpoint.
+                            cursor.execute("START TRANSACTION")
+                            try:
+                                cursor.executemany(STORY_INSERT, story_rows)
+                                if qanda_rows:
+                                    cursor.executemany(QANDA_INSERT, qanda_rows)
+                                if chunks:
+                                    cursor.executemany(CHUNK_INSERT, chunks)
+                                conn.commit()
+                            except Exception:
+                                conn.rollback()
+                                raise
+                        if checkpoint_path:
+                            write_checkpoint(checkpoint_path, split, next_index)
+                        stats.write_seconds += time.perf_counter() - write_start
+                        stats.stories += len(story_rows)
+                        stats.questions += len(qanda_rows)
+                        stats.chunks += len(chunks)
+                        stats.elapsed_seconds = time.perf_counter() - started
+                        if progress:
+                            progress(stats)
+                finally:
+                    cursor.close()
+        except BaseException as error:
+            writer_error.append(error)
+            # Keep draining so the producer never blocks on a dead writer.
+            while batches.get() is not None:
+                pass
+
+    writer = threading.Thread(target=bind_context(write), name="ingest-writer", daemon=True)
+    writer.start()
+    try:
+        stories = islice(enumerate(dataset, start=1), start_index, stop_index)
+        while not writer_error and (batch := list(islice(stories, commit_size))):
+            encode_start = time.perf_counter()
+            with tracer.span("ingest.encode", stories=len(batch)) as span:
+                story_rows, qanda_rows, chunks = _encode_batch(model, model_id, batch, encode_batch_size)
+                span.set(texts=len(story_rows) + len(qanda_rows) + len(chunks))
+            stats.encode_seconds += time.perf_counter() - encode_start
+            stats.embeddings += len(story_rows) + len(qanda_rows) + len(chunks)
+            batches.put((batch[-1][0], story_rows, qanda_rows, chunks))
+    finally:
+        batches.put(None)
+        writer.join()
+
+    if writer_error:
+        raise writer_error[0]
+    stats.elapsed_seconds = time.perf_counter() - started
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load CoQA stories and questions with embeddings into IRIS.")
+    parser.add_argument("--split", default="train")
+    parser.add_argument("--limit", type=int, help="stop after this many stories of the split")
+    parser.add_argument("--encode-batch-size", type=int, default=64, help="texts per model.encode forward pass")
+    parser.add_argument("--commit-size", type=int, default=256, help="stories per encode batch and transaction")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and reload the split from the first story")
+    args = parser.parse_args()
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    dataset = load_dataset(REPO_ID, split=args.split)
+    model = ModelRegistry().get(BASE_EMBEDDING_MODEL)
+    start_index = read_checkpoint(args.checkpoint, args.split)
+    if start_index:
+        print(f"Resuming {args.split} from story {start_index + 1}")
+
+    def report(stats: IngestStats) -> None:
+        print(f"{start_index + stats.stories} stories, {stats.questions} questions, {stats.chunks} chunks | "
+              f"{stats.rows_per_second:.0f} rows/s, {stats.embeddings_per_second:.0f} embeddings/s")
+
+    stats = run_ingest(
+        dataset,
+        model,
+        get_pool(),
+        split=args.split,
+        limit=args.limit,
+        encode_batch_size=args.encode_batch_size,
+        commit_size=args.commit_size,
+        checkpoint_path=args.checkpoint,
+        progress=report,
+    )
+    print(f"Loaded {stats.stories} stories, {stats.questions} questions and {stats.chunks} chunks in {stats.elapsed_seconds:.1f}s "
+          f"(encode {stats.encode_seconds:.1f}s, write {stats.write_seconds:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import logging
+import time
+
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass
+
+from tracing import get_tracer
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TurnTimings:
+    time_to_first_token: float | None = None
+    total_seconds: float = 0.0
+    chunks: int = 0
+    cached: bool = False
+
+
+class TimedStream:
+    """Yields the text of streamed LLM chunks, timing the first token and the whole response.
+
+    Times are measured from ``started`` (default: now), so pass the turn's start time to
+    include retrieval in the time to first token.
+    """
+
+    def __init__(self, chunks, started: float | None = None) -> None:
+        self._chunks = chunks
+        self.started = time.perf_counter() if started is None else started
+        self.parts: list[str] = []
+        self.time_to_first_token: float | None = None
+        self.total_seconds = 0.0
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            text = getattr(chunk, "content", chunk)
+            if not text:
+                continue
+            if self.time_to_first_token is None:
+                self.time_to_first_token = time.perf_counter() - self.started
+            self.parts.append(text)
+            yield text
+        self.total_seconds = time.perf_counter() - self.started
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def timings(self) -> TurnTimings:
+        return TurnTimings(self.time_to_first_token, self.total_seconds, len(self.parts))
+
+
+class BackgroundSummary:
+    """Updates a conversation memory off the request path.
+
+    ConversationSummaryMemory.save_context makes its own LLM call to extend the running summary.
+    Here it runs on ``executor`` once the answer has been shown; the next turn calls ``wait`` (or
+    ``load_memory_variables``) before reading the summary, so it is never stale.
+    """
+
+    def __init__(self, memory, executor: Executor) -> None:
+        self.memory = memory
+        self.executor = executor
+        self._pending: Future | None = None
+
+    def save_context(self, inputs: dict, outputs: dict, on_saved=None) -> None:
+        """``on_saved(memory)`` is called on the executor once the summary is updated, e.g. to persist it.
+
+        A failed earlier update is logged rather than raised: this turn's answer has already been shown.
+        """
+        try:
+            self.wait()
+        except Exception as error:
+            logger.warning("Updating the conversation summary failed, continuing with the previous summary: %r", error)
+        self._pending = self.executor.submit(self._save_context, inputs, outputs, on_saved)
+
+    def _save_context(self, inputs: dict, outputs: dict, on_saved) -> None:
+        with get_tracer().trace("conversation_summary"):
+            with get_tracer().span("llm.summary"):
+                self.memory.save_context(inputs, outputs)
+            if on_saved:
+                on_saved(self.memory)
+
+    def wait(self) -> None:
+        # Re-raises a failed update once; the memory then keeps the summary from before that turn.
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            pending.result()
+
+    def load_memory_variables(self) -> dict:
+        self.wait()
+        return self.memory.load_memory_variables({})
@@ -0,0 +1,348 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from connection_pool import get_pool
+from vector_codec import EMBEDDING_DIMENSION, decode_vector
+from vector_search import RetrievedContext
+
+DEFAULT_SNAPSHOT_DIR = os.getenv("VECTOR_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "vector_snapshot"))
+
+# Upper bound on the size of one (queries x rows) score matrix in the search_many_* methods.
+_MAX_SCORE_ELEMENTS = 1 << 24
+# Rows buffered by LocalVectorSearch.refresh before they are appended to a snapshot.
+_REFRESH_APPEND_ROWS = 50000
+# Recorded in each snapshot's manifest; bumped when the files a snapshot is made of change.
+_SNAPSHOT_FORMAT = 2
+_FINGERPRINT_MODULUS = 1 << 64
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    # Indexes of the k largest scores along the last axis, best first.
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    if k < scores.shape[-1]:
+        candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        candidates = np.broadcast_to(np.arange(k), scores.shape[:-1] + (k,))
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=-1)
+
+
+def _fingerprint(rows) -> int:
+    # Order-independent fingerprint of (ID, ContentHash, EmbeddingModel) rows, so it can be extended as rows are appended.
+    return sum(
+        int.from_bytes(hashlib.blake2b(f"{row_id}|{text_hash}|{model_id}".encode("utf-8"), digest_size=8).digest(), "little")
+        for row_id, text_hash, model_id, *_ in rows
+    ) % _FINGERPRINT_MODULUS
+
+
+def _write_json(path: str, payload) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+class VectorSnapshot:
+    """An append-only, memory-mapped float32 embedding matrix with per-row IDs, keys and payloads.
+
+    On disk this is ``<name>.f32`` (raw row-major float32), ``<name>.ids.i64`` and
+    ``<name>.keys.i64`` (raw int64), ``<name>.payloads.bin`` (each row's payload as JSON, back to
+    back) with ``<name>.offsets.i64`` (where each payload ends), plus ``<name>.manifest.json``
+    which records how many rows are committed and their fingerprint (see _fingerprint). Every file is only appended to and memory-mapped,
+    so an append writes just the new rows and payloads are decoded one row at a time. The manifest
+    is written last, so rows from an interrupted append are ignored and overwritten by the next one.
+    """
+
+    def __init__(self, directory: str, name: str, dimension: int = EMBEDDING_DIMENSION) -> None:
+        self.directory = directory
+        self.name = name
+        self.dimension = dimension
+        self.load()
+
+    def _path(self, suffix: str) -> str:
+        return os.path.join(self.directory, f"{self.name}{suffix}")
+
+    def load(self) -> None:
+        manifest_path = self._path(".manifest.json")
+        count = fingerprint = 0
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest["dimension"] != self.dimension:
+                raise ValueError(f"Snapshot {self.name} has dimension {manifest['dimension']}, expected {self.dimension}")
+            # Snapshots written in an earlier layout are rebuilt by the next refresh.
+            if manifest.get("format") == _SNAPSHOT_FORMAT:
+                count, fingerprint = manifest["count"], manifest.get("fingerprint", 0)
+
+        if count:
+            # Read-only mappings: every process using the snapshot shares the same page cache.
+            self.vectors = np.memmap(self._path(".f32"), dtype="<f4", mode="r", shape=(count, self.dimension))
+            self.ids = np.memmap(self._path(".ids.i64"), dtype="<i8", mode="r", shape=(count,))
+            self.keys = np.memmap(self._path(".keys.i64"), dtype="<i8", mode="r", shape=(count,))
+            self._offsets = np.memmap(self._path(".offsets.i64"), dtype="<i8", mode="r", shape=(count,))
+            self._payloads = np.memmap(self._path(".payloads.bin"), dtype=np.uint8, mode="r", shape=(int(self._offsets[-1]),))
+        else:
+            self.vectors = np.empty((0, self.dimension), dtype=np.float32)
+            self.ids = np.empty(0, dtype=np.int64)
+            self.keys = np.empty(0, dtype=np.int64)
+            self._offsets = np.empty(0, dtype=np.int64)
+            self._payloads = np.empty(0, dtype=np.uint8)
+        self.count = count
+        self.fingerprint = fingerprint
+
+    @property
+    def max_id(self) -> int:
+        return int(self.ids.max()) if self.count else 0
+
+    def payload(self, row: int):
+        start = int(self._offsets[row - 1]) if row else 0
+        return json.loads(self._payloads[start:int(self._offsets[row])].tobytes())
+
+    def _append_file(self, suffix: str, committed_bytes: int, data: bytes) -> None:
+        # Drops anything an interrupted append left past the committed rows.
+        with open(self._path(suffix), "ab") as f:
+            f.truncate(committed_bytes)
+            f.write(data)
+
+    def append(self, ids, keys, vectors, payloads: list, fingerprint: int = 0) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype="<f4")
+        if vectors.shape != (len(ids), self.dimension) or len(keys) != len(ids) or len(payloads) != len(ids):
+            raise ValueError(f"Expected {len(ids)} rows of {self.dimension} dimensions with keys and payloads, got {vectors.shape}")
+        if not len(ids):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+
+        encoded = [json.dumps(payload).encode("utf-8") for payload in payloads]
+        payload_end = int(self._offsets[-1]) if self.count else 0
+        offsets = payload_end + np.cumsum([len(payload) for payload in encoded], dtype=np.int64)
+        row_bytes = self.count * 8
+        self._append_file(".f32", self.count * self.dimension * 4, vectors.tobytes())
+        self._append_file(".ids.i64", row_bytes, np.asarray(ids, dtype="<i8").tobytes())
+        self._append_file(".keys.i64", row_bytes, np.asarray(keys, dtype="<i8").tobytes())
+        self._append_file(".offsets.i64", row_bytes, offsets.astype("<i8").tobytes())
+        self._append_file(".payloads.bin", payload_end, b"".join(encoded))
+        _write_json(self._path(".manifest.json"), {
+            "format": _SNAPSHOT_FORMAT,
+            "dimension": self.dimension,
+            "count": self.count + len(ids),
+            "fingerprint": (self.fingerprint + fingerprint) % _FINGERPRINT_MODULUS,
+        })
+        self.load()
+
+    def clear(self) -> None:
+        for suffix in (".manifest.json", ".f32", ".ids.i64", ".keys.i64", ".offsets.i64", ".payloads.bin"):
+            if os.path.exists(self._path(suffix)):
+                os.remove(self._path(suffix))
+        self.load()
+
+
+class IVFIndex:
+    """Inverted-file index over a snapshot: spherical k-means lists, probed by centroid similarity.
+
+    Only ``n_probe`` of the ``n_lists`` lists are scored exactly per query, trading a little
+    recall for roughly ``n_lists / n_probe`` times less work on large corpora.
+    """
+
+    def __init__(self, vectors: np.ndarray, n_lists: int, n_probe: int = 8, iterations: int = 10, seed: int = 0) -> None:
+        rng = np.random.default_rng(seed)
+        n_lists = max(1, min(n_lists, len(vectors)))
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), min(len(vectors), n_lists * 64), replace=False))])
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(assignment, kind="stable")
+            counts = np.bincount(assignment, minlength=n_lists)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            non_empty = counts > 0
+            centroids[non_empty] = np.add.reduceat(sample[order], starts[non_empty], axis=0)
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+        assignment = np.concatenate([
+            np.argmax(vectors[start:start + 65536] @ centroids.T, axis=1)
+            for start in range(0, len(vectors), 65536)
+        ])
+        self.centroids = centroids
+        self.n_probe = n_probe
+        self._order = np.argsort(assignment, kind="stable")
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))])
+
+    def search(self, vectors: np.ndarray, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        probe = _top_k(self.centroids @ query, self.n_probe)
+        candidates = np.sort(np.concatenate([self._order[self._offsets[p]:self._offsets[p + 1]] for p in probe]))
+        scores = vectors[candidates] @ query
+        best = _top_k(scores, k)
+        return candidates[best], scores[best]
+
+
+class LocalVectorSearch:
+    """In-process backend with the same search methods as VectorSearch.
+
+    Rankings are computed over a local snapshot of RAG_COQA.Story and RAG_COQA.QandA (see
+    VectorSnapshot) instead of in IRIS. Exact search is a vectorized argpartition over the
+    memory-mapped matrix; pass ``approximate=True`` to use an IVF index instead.
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_SNAPSHOT_DIR,
+        approximate: bool = False,
+        n_lists: int | None = None,
+        n_probe: int = 8,
+    ) -> None:
+        self.directory = directory
+        self.approximate = approximate
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.stories = VectorSnapshot(directory, "stories")
+        self.questions = VectorSnapshot(directory, "questions")
+        self._reindex()
+
+    def _reindex(self) -> None:
+        # Snapshot IDs are row IDs (used to fetch new rows) and keys are StoryIds; payloads are
+        # [Story] for stories and [Question, Answer] for questions.
+        self._story_rows = {int(story_id): row for row, story_id in enumerate(self.stories.keys)}
+        self._question_story_ids = self.questions.keys
+        self._ivf = {}
+        if self.approximate:
+            for snapshot in (self.stories, self.questions):
+                if snapshot.count:
+                    n_lists = self.n_lists or max(1, int(np.sqrt(snapshot.count)))
+                    self._ivf[snapshot.name] = IVFIndex(snapshot.vectors, n_lists, self.n_probe)
+
+    def refresh(self, pool=None, full: bool = False, fetch_size: int = 1000) -> dict[str, int]:
+        """Pull rows added since the last refresh (or everything, with ``full=True``) from IRIS.
+
+        New rows are picked up by ID. Snapshots are only appended to, so one is rebuilt when rows
+        it holds have since been deleted, re-inserted or re-embedded (see _unchanged).
+        """
+        pool = pool or get_pool()
+        tables = [
+            (self.stories, "RAG_COQA.Story", "StoryEmbedding, StoryId, Story", lambda row: [row[5]]),
+            (self.questions, "RAG_COQA.QandA", "QuestionEmbedding, StoryID, Question, Answer", lambda row: [row[5], row[6]]),
+        ]
+        added = {}
+        for snapshot, table, columns, payload in tables:
+            if full or not self._unchanged(pool, snapshot, table, fetch_size):
+                snapshot.clear()
+            added[snapshot.name] = 0
+            buffered = []
+
+            def flush():
+                snapshot.append(
+                    [row[0] for row in buffered],
+                    [row[4] for row in buffered],
+                    np.stack([decode_vector(row[3]) for row in buffered]),
+                    [payload(row) for row in buffered],
+                    _fingerprint(buffered),
+                )
+                added[snapshot.name] += len(buffered)
+                buffered.clear()
+
+            with pool.cursor() as iris_cursor:
+                iris_cursor.execute(f"SELECT ID, ContentHash, EmbeddingModel, {columns} FROM {table} WHERE ID > ? ORDER BY ID", [snapshot.max_id])
+                while rows := iris_cursor.fetchmany(fetch_size):
+                    buffered.extend(rows)
+                    if len(buffered) >= _REFRESH_APPEND_ROWS:
+                        flush()
+                if buffered:
+                    flush()
+        self._reindex()
+        return added
+
+    @staticmethod
+    def _unchanged(pool, snapshot: VectorSnapshot, table: str, fetch_size: int) -> bool:
+        # Compares the rows the snapshot holds with the same ID range in IRIS: deleted rows (and re-inserted
+        # ones, which get a new ID) change the count and fingerprint, re-embedded rows the fingerprint.
+        if not snapshot.count:
+            return True
+        count = fingerprint = 0
+        with pool.cursor() as iris_cursor:
+            iris_cursor.execute(f"SELECT ID, ContentHash, EmbeddingModel FROM {table} WHERE ID <= ?", [snapshot.max_id])
+            while rows := iris_cursor.fetchmany(fetch_size):
+                count += len(rows)
+                fingerprint = (fingerprint + _fingerprint(rows)) % _FINGERPRINT_MODULUS
+        return count == snapshot.count and fingerprint == snapshot.fingerprint
+
+    def _search(self, snapshot: VectorSnapshot, query_embedding, top_k: int) -> np.ndarray:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if snapshot.name in self._ivf:
+            rows, _ = self._ivf[snapshot.name].search(snapshot.vectors, query, top_k)
+            return rows
+        return _top_k(snapshot.vectors @ query, top_k)
+
+    def _search_many(self, snapshot: VectorSnapshot, query_embeddings, top_k: int) -> list[np.ndarray]:
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if snapshot.name in self._ivf:
+            return [self._search(snapshot, query, top_k) for query in queries]
+        block = max(1, _MAX_SCORE_ELEMENTS // max(1, snapshot.count))
+        results = []
+        for start in range(0, len(queries), block):
+            results.extend(_top_k(queries[start:start + block] @ snapshot.vectors.T, top_k))
+        return results
+
+    def _stories_for_question_rows(self, rows) -> list:
+        documents = []
+        for row in rows:
+            story_id = int(self._question_story_ids[row])
+            if story_id in self._story_rows:
+                documents.append((self.stories.payload(self._story_rows[story_id])[0], story_id))
+        return documents
+
+    def _stories_for_story_rows(self, rows) -> list:
+        return [(self.stories.payload(row)[0], int(self.stories.keys[row])) for row in rows]
+
+    def search_by_q_and_a(self, query_embedding, top_k:int=4) -> list:
+        return self._stories_for_question_rows(self._search(self.questions, query_embedding, top_k))
+
+    def search_by_story(self, query_embedding, top_k:int=2) -> list:
+        return self._stories_for_story_rows(self._search(self.stories, query_embedding, top_k))
+
+    def search_q_and_a_docs_by_story(self, story_ids: list[str], top_k:int=1) -> list:
+        rows = np.flatnonzero(np.isin(self._question_story_ids, np.asarray(story_ids, dtype=np.int64)))[:top_k]
+        return [dict(zip(('question', 'answer'), self.questions.payload(row))) for row in rows]
+
+    def search_many_by_q_and_a(self, query_embeddings, top_k:int=4) -> list[list]:
+        return [self._stories_for_question_rows(rows) for rows in self._search_many(self.questions, query_embeddings, top_k)]
+
+    def search_many_by_story(self, query_embeddings, top_k:int=2) -> list[list]:
+        return [self._stories_for_story_rows(rows) for rows in self._search_many(self.stories, query_embeddings, top_k)]
+
+    def has_chunk_index(self) -> bool:
+        # The snapshot doesn't hold chunks (yet), so callers use whole stories.
+        return False
+
+    def retrieve_context(self, query_embedding, top_k:int=2, story_top_k:int=1, examples_top_k:int=1, chunk_top_k:int=0) -> RetrievedContext:
+        context = RetrievedContext()
+        start = stage_start = time.perf_counter()
+        context.documents = self.search_by_q_and_a(query_embedding, top_k)
+        context.timings['documents'] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        context.story_documents = self.search_by_story(query_embedding, story_top_k)
+        context.timings['story_documents'] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        context.q_and_a_docs = self.search_q_and_a_docs_by_story([story_id for _, story_id in context.documents], examples_top_k)
+        context.timings['q_and_a_docs'] = time.perf_counter() - stage_start
+        context.timings['total'] = time.perf_counter() - start
+        return context
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Create or refresh the local vector snapshot from IRIS.")
+    parser.add_argument("--directory", default=DEFAULT_SNAPSHOT_DIR)
+    parser.add_argument("--full", action="store_true", help="rebuild from scratch even if no rows were changed or deleted")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    added = LocalVectorSearch(args.directory).refresh(full=args.full)
+    print(f"Added {added['stories']} stories and {added['questions']} questions in {time.perf_counter() - start:.1f}s")
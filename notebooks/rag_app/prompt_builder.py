@@ -0,0 +1,103 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from langchain_classic.docstore.document import Document
+from langchain_text_splitters import CharacterTextSplitter
+
+from tracing import get_tracer
+from vector_search import RetrievedContext
+
+FALLBACK_CHUNK_SIZE = 250
+
+# Tokens of retrieved text allowed into the prompt, and how many ranked chunks to fetch to fill them.
+DEFAULT_TOKEN_BUDGET = 400
+DEFAULT_CHUNK_TOP_K = 8
+
+
+@lru_cache(maxsize=1)
+def _token_encoding():
+    # tiktoken is optional (and fetches its tables on first use); without it tokens are estimated.
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _token_encoding()
+    if encoding is None:
+        # About four characters per token for English text.
+        return max(1, (len(text) + 3) // 4)
+    return len(encoding.encode(text))
+
+
+@dataclass
+class PackedContext:
+    chunks: list[str] = field(default_factory=list)
+    story_ids: list[int] = field(default_factory=list)
+    tokens: int = 0
+    duplicates: int = 0
+    over_budget: int = 0
+
+
+def pack_context(chunks: list, token_budget: int = DEFAULT_TOKEN_BUDGET) -> PackedContext:
+    """Fill ``token_budget`` with the highest-scoring (Chunk, StoryId, Score) rows.
+
+    Chunks whose text repeats (or is contained in) one already packed are dropped; a chunk that
+    doesn't fit is skipped so a smaller, lower-ranked one can still use the remaining budget.
+    """
+    with get_tracer().span("prompt.pack", candidates=len(chunks), token_budget=token_budget) as span:
+        packed = PackedContext()
+        seen: list[str] = []
+        for text, story_id, _ in sorted(chunks, key=lambda row: row[2], reverse=True):
+            key = " ".join(text.split()).lower()
+            if any(key in other for other in seen):
+                packed.duplicates += 1
+                continue
+            tokens = count_tokens(text)
+            if packed.tokens + tokens > token_budget:
+                packed.over_budget += 1
+                continue
+            seen.append(key)
+            packed.chunks.append(text)
+            packed.story_ids.append(story_id)
+            packed.tokens += tokens
+        span.set(chunks=len(packed.chunks), tokens=packed.tokens)
+    return packed
+
+
+def relevant_documents(context: RetrievedContext, chunk_size: int = FALLBACK_CHUNK_SIZE) -> list:
+    """Fallback for databases without a chunk index: split the retrieved stories per request.
+
+    Returns the first three chunks of the question-matched stories, then the best story match.
+    """
+    with get_tracer().span("prompt.chunk", documents=len(context.documents), chunk_size=chunk_size) as span:
+        doc_list = [Document(page_content=doc_content, metadata={"source": "local"}) for doc_content, _ in context.documents]
+        # This can potentially return many large documents, so we should use LangChain to chunk the results:
+        text_splitter = CharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=0)
+        docs = text_splitter.split_documents(doc_list)
+
+        relevant_docs = [str(doc.page_content)[:chunk_size] for doc in docs]
+        relevant_docs.extend(story for story, _ in context.story_documents)
+        span.set(chunks=len(docs))
+    return relevant_docs[:3]
+
+
+def build_prompt(prompt: str, q_and_a_docs: list, relevant_docs: list) -> str:
+    with get_tracer().span("prompt.build") as span:
+        template = _template(prompt, q_and_a_docs, relevant_docs)
+        span.set(chars=len(template))
+    return template
+
+
+def _template(prompt: str, q_and_a_docs: list, relevant_docs: list) -> str:
+    return f"""
+                    Prompt: {prompt}
+
+                    Example Responses: {q_and_a_docs}
+
+                    Relevant Documents: {str(relevant_docs)}
+
+                    You should only make use of the provided Relevant Documents. They are important information belonging to the user, and it is important that any advice you give is grounded in these documents. If the documents are irrelevant to the question, simply state that you do not have the relevant information available in the database.
+                """
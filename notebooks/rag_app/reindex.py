@@ -0,0 +1,233 @@
+"""Re-embed only the stories, questions and chunks whose text or embedding model changed.
+
+Every row records the model and a hash of the text its embedding was computed from. The
+base model's vectors stay in RAG_COQA.Story / RAG_COQA.QandA; any other model is written to
+its own side tables and only marked ready (queryable by VectorSearch) once its backfill is
+complete, so a new model can be filled in while queries keep using the current one.
+
+    python reindex.py                                  # refresh the base model after corpus edits
+    python reindex.py --model all-MiniLM-L6-v2         # backfill / refresh another model generation
+    python reindex.py --adopt-existing                 # stamp rows loaded before hashes were tracked
+"""
+import argparse
+import time
+
+from dataclasses import dataclass, field
+from typing import Callable
+
+from chunking import create_chunk_table
+from connection_pool import ConnectionPool, get_pool
+from embedding_models import ModelRegistry
+from embedding_tables import (
+    BACKFILLING,
+    BASE_EMBEDDING_MODEL,
+    READY,
+    EmbeddingColumns,
+    content_hash,
+    create_generation_tables,
+    create_metadata_columns,
+    ready_generations,
+    set_generation_status,
+)
+from vector_codec import encode_vectors, vector_parameter
+
+
+@dataclass
+class ReindexStats:
+    scanned: dict[str, int] = field(default_factory=dict)
+    embedded: dict[str, int] = field(default_factory=dict)
+    adopted: dict[str, int] = field(default_factory=dict)
+    pruned: dict[str, int] = field(default_factory=dict)
+    elapsed_seconds: float = 0.0
+
+
+@dataclass
+class _Target:
+    name: str
+    # Rows of (key, text, stored hash, stored model, *extra columns needed by write). Side tables
+    # hold a single model, so their rows have no stored model column.
+    select: str
+    write: Callable
+    prune: str | None = None
+    table: str = ""  # base table, for stamping adopted rows
+    side_table: bool = False
+
+
+def _targets(columns: EmbeddingColumns) -> list[_Target]:
+    vector_param = vector_parameter(columns.dimension)
+    if columns.model_id == BASE_EMBEDDING_MODEL:
+        def update(table: str, vector_column: str):
+            def write(cursor, rows):
+                cursor.executemany(
+                    f"UPDATE {table} SET {vector_column} = {vector_param}, EmbeddingModel = ?, ContentHash = ? WHERE ID = ?",
+                    [[embedding, columns.model_id, text_hash, key] for key, text_hash, embedding, _ in rows],
+                )
+            return write
+
+        return [
+            _Target("stories", "SELECT ID, Story, ContentHash, EmbeddingModel FROM RAG_COQA.Story",
+                    update("RAG_COQA.Story", "StoryEmbedding"), table="RAG_COQA.Story"),
+            _Target("questions", "SELECT ID, Question, ContentHash, EmbeddingModel FROM RAG_COQA.QandA",
+                    update("RAG_COQA.QandA", "QuestionEmbedding"), table="RAG_COQA.QandA"),
+            _Target("chunks", "SELECT ID, Chunk, ContentHash, EmbeddingModel FROM RAG_COQA.StoryChunk",
+                    update("RAG_COQA.StoryChunk", "ChunkEmbedding"), table="RAG_COQA.StoryChunk"),
+        ]
+
+    def write_stories(cursor, rows):
+        cursor.executemany(f"DELETE FROM {columns.story_table} WHERE StoryId = ?", [[key] for key, _, _, _ in rows])
+        cursor.executemany(
+            f"INSERT INTO {columns.story_table} (StoryId, ContentHash, Embedding) VALUES (?, ?, {vector_param})",
+            [[key, text_hash, embedding] for key, text_hash, embedding, _ in rows],
+        )
+
+    def write_questions(cursor, rows):
+        cursor.executemany(f"DELETE FROM {columns.question_table} WHERE QandAId = ?", [[key] for key, _, _, _ in rows])
+        cursor.executemany(
+            f"INSERT INTO {columns.question_table} (QandAId, StoryId, ContentHash, Embedding) VALUES (?, ?, ?, {vector_param})",
+            [[key, extra[0], text_hash, embedding] for key, text_hash, embedding, extra in rows],
+        )
+
+    def write_chunks(cursor, rows):
+        cursor.executemany(f"DELETE FROM {columns.chunk_table} WHERE ChunkId = ?", [[key] for key, _, _, _ in rows])
+        cursor.executemany(
+            f"INSERT INTO {columns.chunk_table} (ChunkId, StoryId, ContentHash, Embedding) VALUES (?, ?, ?, {vector_param})",
+            [[key, extra[0], text_hash, embedding] for key, text_hash, embedding, extra in rows],
+        )
+
+    return [
+        _Target("stories",
+                f"""SELECT s.StoryId, s.Story, e.ContentHash
+                    FROM RAG_COQA.Story s LEFT JOIN {columns.story_table} e ON e.StoryId = s.StoryId""",
+                write_stories,
+                f"DELETE FROM {columns.story_table} WHERE StoryId NOT IN (SELECT StoryId FROM RAG_COQA.Story)",
+                side_table=True),
+        _Target("questions",
+                f"""SELECT q.ID, q.Question, e.ContentHash, q.StoryId
+                    FROM RAG_COQA.QandA q LEFT JOIN {columns.question_table} e ON e.QandAId = q.ID""",
+                write_questions,
+                f"DELETE FROM {columns.question_table} WHERE QandAId NOT IN (SELECT ID FROM RAG_COQA.QandA)",
+                side_table=True),
+        # Chunk IDs change whenever chunking.sync_chunks rebuilds a story, so stale rows are pruned here.
+        _Target("chunks",
+                f"""SELECT c.ID, c.Chunk, e.ContentHash, c.StoryId
+                    FROM RAG_COQA.StoryChunk c LEFT JOIN {columns.chunk_table} e ON e.ChunkId = c.ID""",
+                write_chunks,
+                f"DELETE FROM {columns.chunk_table} WHERE ChunkId NOT IN (SELECT ID FROM RAG_COQA.StoryChunk)",
+                side_table=True),
+    ]
+
+
+def reindex(
+    model,
+    model_id: str,
+    pool: ConnectionPool,
+    batch_size: int = 256,
+    encode_batch_size: int = 64,
+    adopt_existing: bool = False,
+    progress=None,
+) -> ReindexStats:
+    """Bring ``model_id``'s embeddings up to date with the corpus, embedding only stale rows.
+
+    A row is stale when its stored hash doesn't match its current text, or its embedding came
+    from a different model. With ``adopt_existing``, base rows that have an embedding but no
+    hash yet (loaded before hashes were tracked) are assumed to be from ``model_id`` and only
+    stamped, not re-embedded.
+    """
+    started = time.perf_counter()
+    dimension = model.get_sentence_embedding_dimension()
+    stats = ReindexStats()
+
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            create_metadata_columns(cursor)
+            create_chunk_table(cursor)
+            columns = create_generation_tables(cursor, model_id, dimension)
+            base = model_id == BASE_EMBEDDING_MODEL
+            if not base and model_id not in ready_generations(cursor):
+                set_generation_status(cursor, model_id, dimension, BACKFILLING)
+
+            for target in _targets(columns):
+                cursor.execute(target.select)
+                rows = cursor.fetchall()
+                stale, adopt = [], []
+                for row in rows:
+                    if target.side_table:
+                        key, text, stored_hash, *extra = row
+                        stored_model = model_id if stored_hash is not None else None
+                    else:
+                        key, text, stored_hash, stored_model, *extra = row
+                    text_hash = content_hash(text or "")
+                    if stored_hash == text_hash and stored_model == model_id:
+                        continue
+                    if adopt_existing and base and stored_hash is None and stored_model is None:
+                        adopt.append([model_id, text_hash, key])
+                    else:
+                        stale.append((key, text or "", text_hash, extra))
+                stats.scanned[target.name] = len(rows)
+                stats.embedded[target.name] = 0
+                stats.adopted[target.name] = len(adopt)
+
+                if adopt:
+                    cursor.executemany(f"UPDATE {target.table} SET EmbeddingModel = ?, ContentHash = ? WHERE ID = ?", adopt)
+                    conn.commit()
+
+                for start in range(0, len(stale), batch_size):
+                    batch = stale[start:start + batch_size]
+                    embeddings = encode_vectors(model.encode([text for _, text, _, _ in batch], batch_size=encode_batch_size), dimension)
+                    cursor.execute("START TRANSACTION")
+                    try:
+                        target.write(cursor, [(key, text_hash, embedding, extra)
+                                              for (key, _, text_hash, extra), embedding in zip(batch, embeddings)])
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    stats.embedded[target.name] += len(batch)
+                    if progress:
+                        progress(target.name, stats.embedded[target.name], len(stale))
+
+                if target.prune:
+                    cursor.execute(target.prune)
+                    stats.pruned[target.name] = cursor.rowcount
+                    conn.commit()
+
+            if not base:
+                set_generation_status(cursor, model_id, dimension, READY)
+                conn.commit()
+        finally:
+            cursor.close()
+
+    stats.elapsed_seconds = time.perf_counter() - started
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Re-embed new or changed stories and questions.")
+    parser.add_argument("--model", default=BASE_EMBEDDING_MODEL)
+    parser.add_argument("--batch-size", type=int, default=256, help="rows per encode batch and transaction")
+    parser.add_argument("--encode-batch-size", type=int, default=64, help="texts per model.encode forward pass")
+    parser.add_argument("--adopt-existing", action="store_true",
+                        help="assume base rows without a hash were embedded with --model and only record the hash")
+    args = parser.parse_args()
+
+    def report(name: str, done: int, total: int) -> None:
+        print(f"{args.model} {name}: {done}/{total} re-embedded")
+
+    stats = reindex(
+        ModelRegistry().get(args.model),
+        args.model,
+        get_pool(),
+        batch_size=args.batch_size,
+        encode_batch_size=args.encode_batch_size,
+        adopt_existing=args.adopt_existing,
+        progress=report,
+    )
+    for name in stats.scanned:
+        print(f"{name}: scanned {stats.scanned[name]}, re-embedded {stats.embedded[name]}, "
+              f"adopted {stats.adopted[name]}, pruned {stats.pruned.get(name, 0)}")
+    print(f"Done in {stats.elapsed_seconds:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,9 @@
+import atexit
+import logging
 import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
 
 import streamlit as st
 
@@ -8,46 +13,193 @@ from langchain_community.chat_models import ChatOpenAI
 from langchain_classic.chains import LLMChain, ConversationChain
 from langchain_classic.chains.conversation.memory import ConversationSummaryMemory
 from langchain_community.callbacks.manager import get_openai_callback
-from langchain_text_splitters import CharacterTextSplitter
-from langchain_classic.docstore.document import Document
 from langchain_community.embeddings import OpenAIEmbeddings
 
-from sentence_transformers import SentenceTransformer
-
-from vector_search import VectorSearch
+from answer_cache import InMemoryAnswerStore, IRISAnswerStore, SemanticAnswerCache
+from connection_pool import get_pool
+from conversation_store import ConversationStore, ConversationTurn
+from embedding_models import DEFAULT_EMBEDDING_MODEL, EmbeddingCache, ModelRegistry
+from llm_streaming import BackgroundSummary, TimedStream, TurnTimings
+from local_index import LocalVectorSearch
+from prompt_builder import DEFAULT_CHUNK_TOP_K, DEFAULT_TOKEN_BUDGET, build_prompt, pack_context, relevant_documents
+from tracing import get_tracer, serve_metrics
+from vector_codec import EMBEDDING_DIMENSION
+from vector_search import RetrievedContext, VectorSearch
 
 load_dotenv(find_dotenv(usecwd=True), override=True)
 
+logger = logging.getLogger(__name__)
+
 st.header('Vector Search', divider='orange')
-model = SentenceTransformer("avsolatorio/GIST-Embedding-v0", cache_folder='..\\notebooks\\huggingface_cache')
 
 openai_api_key = os.getenv("OPENAI_API_KEY")
 if not openai_api_key:
     st.error("Missing OPENAI_API_KEY. Set it in your environment or in .env")
     st.stop()
 
-llm = ChatOpenAI(
-    temperature=0,
-    openai_api_key=openai_api_key,
-    model_name=os.getenv("OPENAI_MODEL", "gpt-4.1-mini"),
-)
+# Streamlit re-runs this script on every interaction, so anything expensive is cached per process.
+@st.cache_resource
+def get_embedding_cache() -> EmbeddingCache:
+    return EmbeddingCache(
+        ModelRegistry(),
+        max_size=int(os.getenv("EMBEDDING_CACHE_SIZE", "1024")),
+        directory=os.getenv("EMBEDDING_CACHE_DIR") or None,
+    )
+
+@st.cache_resource
+def get_llm() -> ChatOpenAI:
+    return ChatOpenAI(
+        temperature=0,
+        openai_api_key=openai_api_key,
+        model_name=os.getenv("OPENAI_MODEL", "gpt-4.1-mini"),
+    )
+
+@st.cache_resource
+def get_answer_cache() -> SemanticAnswerCache:
+    # Shared by all sessions: popular questions asked by one user are answered from cache for the next.
+    ttl_seconds = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+    max_entries = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+    if os.getenv("ANSWER_CACHE_BACKEND", "memory") == "iris":
+        store = IRISAnswerStore(get_pool(), max_entries=max_entries, ttl_seconds=ttl_seconds)
+    else:
+        store = InMemoryAnswerStore(max_entries=max_entries, ttl_seconds=ttl_seconds)
+    return SemanticAnswerCache(store, threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")))
+
+@st.cache_resource
+def get_summary_executor() -> ThreadPoolExecutor:
+    # Conversation summaries are updated here after each answer, off the request path.
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="conversation-summary")
+
+@st.cache_resource
+def get_conversation_store() -> ConversationStore | None:
+    # Chat history in IRIS, written in batches behind the chat turn (see conversation_store.py).
+    if os.getenv("CONVERSATION_HISTORY", "0") != "1":
+        return None
+    store = ConversationStore(get_pool(), flush_interval=float(os.getenv("CONVERSATION_FLUSH_SECONDS", "0.5")))
+    atexit.register(store.close)
+    return store
+
+@st.cache_resource
+def start_metrics_server() -> None:
+    # Prometheus metrics for this process at /metrics. A busy port only costs the endpoint, not tracing.
+    port = os.getenv("TRACING_METRICS_PORT")
+    if not get_tracer().enabled or not port:
+        return
+    try:
+        serve_metrics(get_tracer(), int(port), host=os.getenv("TRACING_METRICS_HOST", "127.0.0.1"))
+    except OSError as error:
+        logger.warning("Could not serve tracing metrics on port %s: %r", port, error)
+
+llm = get_llm()
+# Per-stage spans (see tracing.py); a no-op unless TRACING_ENABLED=1.
+tracer = get_tracer()
+start_metrics_server()
+
+def start_conversation_state() -> None:
+    # Create chain. We are using Summary Memory for fewer tokens.
+    # The memory belongs to this user's conversation, so the chain lives in the session rather than the process cache.
+    st.session_state["conversation_sum"] = ConversationChain(
+        llm=llm,
+        memory=ConversationSummaryMemory(llm=llm),
+        verbose=True
+    )
+    st.session_state["conversation_summary"] = BackgroundSummary(st.session_state["conversation_sum"].memory, get_summary_executor())
+    st.session_state["messages"] = [
+        {"role": "assistant", "content": "Hi, I'm a chatbot that can access your vector stores. What would you like to know?"}
+    ]
+    # {"id", "username", "turns", "first_turn"} once the conversation has been saved; first_turn is the oldest one shown.
+    st.session_state["conversation"] = None
 
-# Create chain. We are using Summary Memory for fewer tokens.
-conversation_sum = ConversationChain(
-    llm=llm,
-    memory=ConversationSummaryMemory(llm=llm),
-    verbose=True
-)
+def turn_messages(turn: ConversationTurn) -> list[dict]:
+    return [{"role": "user", "content": turn.human_message}, {"role": "assistant", "content": turn.ai_message}]
+
+def summary_saver(store: ConversationStore, conversation_id: str, summary_turns: int):
+    return lambda memory: store.save_summary(conversation_id, memory.buffer, summary_turns)
+
+def resume_conversation(store: ConversationStore, username: str, conversation_id: str) -> None:
+    conversation = store.conversation(username, conversation_id)
+    if conversation is None:
+        return
+    turns = store.turns(username, conversation_id)
+    start_conversation_state()
+    st.session_state["messages"] += [message for turn in turns for message in turn_messages(turn)]
+    # The stored summary stands in for the earlier messages, so they aren't replayed through the LLM.
+    st.session_state["conversation_sum"].memory.buffer = conversation.summary
+    # Turns answered after the summary was last saved (the app stopped first) are summarized again in the background.
+    for turn in turns:
+        if turn.turn_index >= conversation.summary_turns:
+            st.session_state["conversation_summary"].save_context(
+                {"input": turn.human_message}, {"response": turn.ai_message},
+                on_saved=summary_saver(store, conversation_id, turn.turn_index + 1),
+            )
+    st.session_state["conversation"] = {
+        "id": conversation_id, "username": username, "turns": conversation.turns, "first_turn": turns[0].turn_index if turns else 0,
+    }
+
+if "conversation_sum" not in st.session_state:
+    start_conversation_state()
+    st.session_state["turn_timings"] = []
+conversation_sum = st.session_state["conversation_sum"]
+conversation_summary = st.session_state["conversation_summary"]
+
+@st.cache_resource
+def get_vector_search(embedding_model: str = DEFAULT_EMBEDDING_MODEL) -> VectorSearch | LocalVectorSearch:
+    # One instance per embedding model and process (sharing one connection pool or snapshot mapping) for all Streamlit sessions.
+    if os.getenv("VECTOR_BACKEND", "iris") == "local":
+        return LocalVectorSearch(approximate=os.getenv("VECTOR_SNAPSHOT_APPROXIMATE", "0") == "1")
+    return VectorSearch(embedding_model=embedding_model, dimension=get_embedding_cache().registry.dimension(embedding_model))
+
+@st.cache_data(ttl=60)
+def get_searchable_models() -> dict[str, int]:
+    # Models with a complete set of embeddings (see reindex.py). The local snapshot only holds the base model.
+    if isinstance(get_vector_search(), LocalVectorSearch):
+        return {DEFAULT_EMBEDDING_MODEL: EMBEDDING_DIMENSION}
+    return get_vector_search().ready_embedding_models()
 
 with st.sidebar:
     st.header('Settings', divider='orange')
     choose_embed = st.radio("Choose an embedding model:",("all-MiniLM-L6-v2","avsolatorio/GIST-Embedding-v0","None"),index=1)
     choose_LM = st.radio("Choose a language model:",("gpt-4.1-mini","None"),index=0)
+    embedding_cache = get_embedding_cache()
+    if choose_embed != "None" and choose_embed not in get_searchable_models():
+        st.warning(f"{choose_embed} embeddings haven't been indexed yet (run reindex.py --model {choose_embed}), using {DEFAULT_EMBEDDING_MODEL} for search.")
+        choose_embed = DEFAULT_EMBEDDING_MODEL
+    with st.expander("Embedding cache"):
+        st.json(vars(embedding_cache.stats()))
+    answer_cache = get_answer_cache()
+    with st.expander("Answer cache"):
+        answer_stats = answer_cache.stats()
+        st.json({**vars(answer_stats), "hit_rate": round(answer_stats.hit_rate, 3)})
+    with st.expander("Latency"):
+        # Time to first token and to the last token of the most recent turns, in seconds.
+        st.json([vars(timings) for timings in st.session_state["turn_timings"][-5:]])
+    if isinstance(get_vector_search(), VectorSearch):
+        with st.expander("Connection pool"):
+            st.json(vars(get_vector_search().pool_stats()))
+    conversation_store = get_conversation_store()
+    username = ""
+    if conversation_store:
+        with st.expander("Conversations"):
+            # Nothing is saved or listed without a username, so visitors don't share one by default.
+            username = st.text_input("Username", value=os.getenv("CHAT_USERNAME", "")).strip()
+            if st.button("New conversation"):
+                start_conversation_state()
+                st.rerun()
+            if not username:
+                st.caption("Enter a username to save and resume conversations.")
+            for saved in conversation_store.conversations(username, limit=10) if username else []:
+                if st.button(f"{saved.title} ({saved.turns} turns)", key=saved.conversation_id):
+                    resume_conversation(conversation_store, username, saved.conversation_id)
+                    st.rerun()
+            st.json(vars(conversation_store.stats()))
 
-if "messages" not in st.session_state:
-    st.session_state["messages"] = [
-        {"role": "assistant", "content": "Hi, I'm a chatbot that can access your vector stores. What would you like to know?"}
-    ]
+# Resumed conversations show their latest turns; older ones are loaded a page at a time.
+conversation = st.session_state["conversation"]
+if conversation_store and conversation and conversation["first_turn"] > 0 and st.button("Show earlier messages"):
+    earlier = conversation_store.turns(conversation["username"], conversation["id"], before_turn=conversation["first_turn"])
+    st.session_state.messages[1:1] = [message for turn in earlier for message in turn_messages(turn)]
+    conversation["first_turn"] = earlier[0].turn_index if earlier else 0
+    st.rerun()
 
 for msg in st.session_state.messages:
     if msg["role"] == "assistant":
@@ -56,43 +208,95 @@ for msg in st.session_state.messages:
         st.chat_message(msg["role"]).write(msg["content"].replace("$", "\\$"))
 
 if prompt := st.chat_input():
+    turn_started = time.perf_counter()
 
     st.session_state.messages.append({"role": "user", "content": prompt})
     st.chat_message("user").write(prompt.replace("$", "\\$")) # Escaping '$', otherwise Streamlit can interpret it as Latex
 
-    # Instantiate this custom Python class (vector_search.py) which gives us SQL access to the persisted vector embeddings.
-    peristent_DB = VectorSearch()
+    # This custom Python class (vector_search.py) gives us pooled SQL access to the persisted vector embeddings.
+    peristent_DB = get_vector_search(DEFAULT_EMBEDDING_MODEL if choose_embed == "None" else choose_embed)
 
-    with st.chat_message("assistant"):
-        #;
-        # Encode the user's prompt and find the top-k similar questions in the vector DB.
-        embedding = model.encode(prompt)
-        documents = peristent_DB.search_by_q_and_a(embedding.tolist(), top_k=2)
-        story_direct_doc = peristent_DB.search_by_story(embedding.tolist(), top_k=1)
-        doc_content_list, doc_id_list = map(list, zip(*documents))
-        doc_list = [Document(page_content=doc_content, metadata={"source": "local"}) for doc_content in doc_content_list]
+    with st.chat_message("assistant"), tracer.trace("chat_turn", embedding_model=choose_embed) as turn:
         #;
-        # This can potentially return many large documents, so we should use LangChain to chunk the results:
-        text_splitter = CharacterTextSplitter(chunk_size=250, chunk_overlap=0)
-        docs = text_splitter.split_documents(doc_list)
+        # Encode the user's prompt (cached per model and text) and find the top-k similar questions in the vector DB.
+        if choose_embed == "None":
+            context = RetrievedContext()
+        else:
+            embedding = embedding_cache.encode(prompt, choose_embed)
+            # Similar questions, the most similar story, example Q&As and the best story chunks (when chunks
+            # have been loaded, see chunking.py), fetched together in one round-trip.
+            chunk_top_k = int(os.getenv("CHUNK_TOP_K", DEFAULT_CHUNK_TOP_K)) if peristent_DB.has_chunk_index() else 0
+            context = peristent_DB.retrieve_context(embedding, top_k=2, story_top_k=1, examples_top_k=1, chunk_top_k=chunk_top_k)
         #;
-        q_and_a_docs = peristent_DB.search_q_and_a_docs_by_story(doc_id_list)
-
-        relevant_docs = [str(doc.page_content)[:250] for doc in docs]
-        relevant_docs.append(story_direct_doc)
+        # The best distinct chunks that fit the token budget; without a chunk index, the retrieved stories are split here.
+        # (prompt_builder.py is shared with benchmarks/rag_bench.py.)
+        q_and_a_docs = context.q_and_a_docs
+        if context.chunks:
+            relevant_docs = pack_context(context.chunks, int(os.getenv("CONTEXT_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET))).chunks
+        else:
+            relevant_docs = relevant_documents(context)
 
-        relevant_docs[:3]
+        template = build_prompt(prompt, q_and_a_docs, relevant_docs)
+        # The previous turn's summary update has usually finished during retrieval; wait for it if not.
+        try:
+            with tracer.span("summary.wait"):
+                history = conversation_summary.load_memory_variables()
+        except Exception as error:
+            st.warning(f"Updating the conversation summary failed, continuing with the previous summary: {error}")
+            history = conversation_sum.memory.load_memory_variables({})
+        # Near-duplicate prompts that retrieved the same stories, with the same conversation summary, reuse an earlier
+        # answer instead of calling the LLM.
+        cache_key = None
+        if choose_embed != "None":
+            retrieved_ids = [row[1] for row in context.documents + context.story_documents + context.chunks]
+            cache_key = SemanticAnswerCache.context_key(f"{os.getenv('OPENAI_MODEL', 'gpt-4.1-mini')}|{choose_embed}", retrieved_ids,
+                                                        history=str(history.get(conversation_sum.memory.memory_key, "")))
+        cached = answer_cache.lookup(embedding, cache_key) if cache_key else None
+        if cached:
+            response = cached.response
+            st.write(response.replace("$", "\\$"))
+            elapsed = time.perf_counter() - turn_started
+            timings = TurnTimings(time_to_first_token=elapsed, total_seconds=elapsed, chunks=1, cached=True)
+        else:
+            # Same prompt ConversationChain would send, but streamed into the message as tokens arrive.
+            with tracer.span("llm.answer") as span:
+                llm_prompt = conversation_sum.prompt.format(input=template, **history)
+                stream = TimedStream(llm.stream(llm_prompt), started=turn_started)
+                st.write_stream(text.replace("$", "\\$") for text in stream)
+                span.set(prompt_chars=len(llm_prompt), tokens=len(stream.parts), time_to_first_token=stream.time_to_first_token)
+            response = stream.text
+            timings = stream.timings()
+            if cache_key:
+                answer_cache.add(embedding, cache_key, response)
 
-        template = f"""
-                    Prompt: {prompt}
+        # The turn is saved by the store's writer thread; the summary is saved once its update below has finished.
+        on_saved = None
+        if conversation_store and (username or st.session_state["conversation"]):
+            conversation = st.session_state["conversation"]
+            if conversation is None:
+                conversation_id = conversation_store.start_conversation(username, prompt[:100])
+                conversation = st.session_state["conversation"] = {"id": conversation_id, "username": username, "turns": 0, "first_turn": 0}
+            conversation_store.append_turn(conversation["username"], conversation["id"], conversation["turns"], prompt, response)
+            conversation["turns"] += 1
+            on_saved = summary_saver(conversation_store, conversation["id"], conversation["turns"])
 
-                    Example Responses: {q_and_a_docs}
+        # The summary LLM call runs in the background; the next turn waits for it before reading the summary.
+        conversation_summary.save_context({"input": template}, {"response": response}, on_saved=on_saved)
+        st.session_state.messages.append({"role": "assistant", "content": response})
+        st.session_state["turn_timings"].append(timings)
+        turn.set(cached=cached is not None)
+    st.session_state["last_trace"] = turn
 
-                    Relevant Documents: {str(relevant_docs[:3])}
-
-                    You should only make use of the provided Relevant Documents. They are important information belonging to the user, and it is important that any advice you give is grounded in these documents. If the documents are irrelevant to the question, simply state that you do not have the relevant information available in the database.
-                """
-        resp = conversation_sum(template)
-
-        st.session_state.messages.append({"role": "assistant", "content": resp['response']})
-        st.write(resp['response'].replace("$", "\\$"))
+# Rendered last, so it already shows the turn that just ran.
+with st.sidebar:
+    with st.expander("Last turn breakdown"):
+        last_trace = st.session_state.get("last_trace")
+        if not tracer.enabled:
+            st.caption("Set TRACING_ENABLED=1 to record per-stage timings.")
+        elif last_trace:
+            st.caption(f"{last_trace.duration_seconds * 1000:.0f} ms in total")
+            st.dataframe([
+                {"stage": span.name, "start_ms": round(span.offset_seconds * 1000, 1), "ms": round(span.duration_seconds * 1000, 1),
+                 "attributes": ", ".join(f"{key}={value}" for key, value in span.attributes.items())}
+                for span in sorted(last_trace.spans, key=lambda span: span.offset_seconds)
+            ], hide_index=True)
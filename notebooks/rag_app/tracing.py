@@ -0,0 +1,256 @@
+"""Timed spans for the chat turn and ingestion stages, aggregated into in-process histograms.
+
+    tracer = get_tracer()
+    with tracer.trace("chat_turn") as turn:
+        with tracer.span("vector_search.fused", top_k=2) as span:
+            rows = ...
+            span.set(rows=len(rows))
+    turn.spans  # every span finished inside the trace, including on threads started with submit / bind_context
+
+Tracing is off unless TRACING_ENABLED=1; a disabled tracer hands out one shared no-op span.
+Finished traces can be appended to a JSONL file (TRACING_JSONL), and the histograms served in
+the Prometheus text format by serve_metrics. Only the Streamlit app starts that server, on
+TRACING_METRICS_PORT, so ingest.py and the other scripts can share its .env.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds, from a cached embedding lookup up to a slow LLM completion.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Span attributes that are counts, summed per stage into rag_stage_attribute_total. Others (top_k, model, ...) only appear in traces.
+COUNTED_ATTRIBUTES = frozenset({"rows", "payload_bytes", "tokens", "chars", "prompt_chars", "texts", "stories", "questions", "chunks", "hits", "queries"})
+
+
+@dataclass
+class Span:
+    name: str
+    attributes: dict = field(default_factory=dict)
+    parent: str | None = None
+    offset_seconds: float = 0.0  # start, relative to the start of the trace
+    duration_seconds: float = 0.0
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+
+@dataclass
+class Trace:
+    name: str
+    attributes: dict = field(default_factory=dict)
+    started_at: float = 0.0  # wall clock
+    duration_seconds: float = 0.0
+    spans: list[Span] = field(default_factory=list)
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace": self.name,
+            "started_at": self.started_at,
+            "duration_seconds": self.duration_seconds,
+            "attributes": self.attributes,
+            "spans": [vars(span) for span in self.spans],
+        }
+
+
+class _NullSpan:
+    """Returned by a disabled tracer for both spans and traces."""
+
+    name = ""
+    attributes: dict = {}
+    spans: list = []
+    duration_seconds = 0.0
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+_current_trace: contextvars.ContextVar[tuple[Trace, float] | None] = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar[str | None] = contextvars.ContextVar("current_span", default=None)
+
+
+def bind_context(fn):
+    """``fn``, to run in a copy of the calling thread's context.
+
+    Context variables don't follow work onto other threads, so spans started by ``fn`` on a
+    worker or writer thread would otherwise not join the caller's trace (or nest under its
+    current span). Bind on the thread that owns the trace, before handing ``fn`` over.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def submit(executor: Executor, fn, *args) -> Future:
+    """``executor.submit(fn, *args)``, with ``fn`` bound to the caller's context (see bind_context)."""
+    return executor.submit(bind_context(fn), *args)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class _ActiveSpan:
+    def __init__(self, tracer: "Tracer", span: Span) -> None:
+        self._tracer = tracer
+        self.span = span
+
+    def __enter__(self) -> Span:
+        self._started = time.perf_counter()
+        self._trace = _current_trace.get()
+        if self._trace is not None:
+            self.span.offset_seconds = self._started - self._trace[1]
+        self.span.parent = _current_span.get()
+        self._token = _current_span.set(self.span.name)
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.span.duration_seconds = time.perf_counter() - self._started
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.span.attributes["error"] = exc_type.__name__
+        if self._trace is not None:
+            self._trace[0].spans.append(self.span)
+        self._tracer._record(self.span.name, self.span.duration_seconds, self.span.attributes)
+
+
+class _ActiveTrace:
+    def __init__(self, tracer: "Tracer", trace: Trace) -> None:
+        self._tracer = tracer
+        self.trace = trace
+
+    def __enter__(self) -> Trace:
+        self._started = time.perf_counter()
+        self.trace.started_at = time.time()
+        self._token = _current_trace.set((self.trace, self._started))
+        return self.trace
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.trace.duration_seconds = time.perf_counter() - self._started
+        _current_trace.reset(self._token)
+        if exc_type is not None:
+            self.trace.attributes["error"] = exc_type.__name__
+        self._tracer._record(self.trace.name, self.trace.duration_seconds, self.trace.attributes)
+        self._tracer._export(self.trace)
+
+
+class Tracer:
+    """Creates spans and traces and aggregates their durations (and count attributes) by name."""
+
+    def __init__(self, enabled: bool = True, jsonl_path: str | None = None, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.enabled = enabled
+        self.jsonl_path = jsonl_path
+        self.buckets = buckets
+        self._histograms: dict[str, Histogram] = {}
+        self._totals: dict[tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def span(self, name: str, **attributes) -> _ActiveSpan | _NullSpan:
+        if not self.enabled:
+            return NULL_SPAN
+        return _ActiveSpan(self, Span(name, attributes))
+
+    def trace(self, name: str, **attributes) -> _ActiveTrace | _NullSpan:
+        """Collects the spans finished inside it (see the module docstring); also timed as a span."""
+        if not self.enabled:
+            return NULL_SPAN
+        return _ActiveTrace(self, Trace(name, attributes))
+
+    def _record(self, name: str, seconds: float, attributes: dict) -> None:
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+            for key, value in attributes.items():
+                if key in COUNTED_ATTRIBUTES and isinstance(value, (int, float)):
+                    self._totals[(name, key)] = self._totals.get((name, key), 0) + value
+
+    def _export(self, trace: Trace) -> None:
+        if not self.jsonl_path:
+            return
+        line = json.dumps(trace.to_dict(), default=str)
+        with self._lock:
+            with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def prometheus(self) -> str:
+        """The histograms and attribute totals in the Prometheus text exposition format."""
+        with self._lock:
+            lines = ["# HELP rag_stage_seconds Duration of pipeline stages.", "# TYPE rag_stage_seconds histogram"]
+            for name, histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip([*map(str, histogram.buckets), "+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f'rag_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'rag_stage_seconds_sum{{stage="{name}"}} {histogram.sum}')
+                lines.append(f'rag_stage_seconds_count{{stage="{name}"}} {histogram.count}')
+            lines += ["# HELP rag_stage_attribute_total Sum of count attributes (rows, payload_bytes, tokens, ...) of each stage's spans.", "# TYPE rag_stage_attribute_total counter"]
+            for (name, key), total in sorted(self._totals.items()):
+                lines.append(f'rag_stage_attribute_total{{stage="{name}",attribute="{key}"}} {total}')
+        return "\n".join(lines) + "\n"
+
+
+def serve_metrics(tracer: Tracer, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve ``tracer.prometheus()`` at http://host:port/metrics from a daemon thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = tracer.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+_tracer: Tracer | None = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """Return the process-wide tracer, configured from TRACING_ENABLED and TRACING_JSONL on first use."""
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = Tracer(enabled=os.getenv("TRACING_ENABLED", "0") == "1", jsonl_path=os.getenv("TRACING_JSONL") or None)
+    return _tracer
@@ -0,0 +1,58 @@
+import numpy as np
+
+# Must match the column definitions in data_loader.ipynb: VECTOR(DOUBLE, 768).
+EMBEDDING_DIMENSION = 768
+VECTOR_TYPE = "DOUBLE"
+
+
+def vector_parameter(dimension: int = EMBEDDING_DIMENSION) -> str:
+    # SQL placeholder for an encoded vector parameter. Declaring the type and length lets IRIS
+    # parse the value straight into the column type instead of inferring it.
+    return f"TO_VECTOR(?, {VECTOR_TYPE}, {dimension})"
+
+
+VECTOR_PARAMETER = vector_parameter()
+
+# The DB-API driver only binds VECTOR parameters as text, so the most compact form it accepts is
+# a bare comma-separated list. "%.9g" round-trips any float32 exactly and "%.17g" any float64,
+# while str(list) always expands float32 values to their full float64 repr.
+_PRECISION = {np.dtype(np.float16): 5, np.dtype(np.float32): 9, np.dtype(np.float64): 17}
+_templates: dict[tuple[int, int], str] = {}
+
+
+def _template(dimension: int, precision: int) -> str:
+    key = (dimension, precision)
+    template = _templates.get(key)
+    if template is None:
+        template = _templates[key] = ",".join([f"%.{precision}g"] * dimension)
+    return template
+
+
+def validate_vectors(vectors, dimension: int = EMBEDDING_DIMENSION) -> np.ndarray:
+    array = np.asarray(vectors)
+    if array.dtype not in _PRECISION:
+        raise ValueError(f"Embeddings must be float16/32/64 to fit VECTOR({VECTOR_TYPE}, {dimension}), got {array.dtype}")
+    if array.ndim not in (1, 2) or array.shape[-1] != dimension:
+        raise ValueError(f"Embeddings must have {dimension} dimensions to fit VECTOR({VECTOR_TYPE}, {dimension}), got shape {array.shape}")
+    if not np.isfinite(array).all():
+        raise ValueError("Embeddings must not contain NaN or infinite values")
+    return array
+
+
+def encode_vector(vector, dimension: int = EMBEDDING_DIMENSION) -> str:
+    array = validate_vectors(vector, dimension)
+    if array.ndim != 1:
+        raise ValueError(f"Expected a single embedding, got shape {array.shape}")
+    return _template(dimension, _PRECISION[array.dtype]) % tuple(array.tolist())
+
+
+def encode_vectors(vectors, dimension: int = EMBEDDING_DIMENSION) -> list[str]:
+    array = validate_vectors(vectors, dimension)
+    if array.ndim != 2:
+        raise ValueError(f"Expected a 2-D array of embeddings, got shape {array.shape}")
+    template = _template(dimension, _PRECISION[array.dtype])
+    return [template % tuple(row) for row in array.tolist()]
+
+
+def decode_vector(text: str) -> np.ndarray:
+    return np.array(text.strip("[]").split(","), dtype=np.float64)
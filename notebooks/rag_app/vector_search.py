@@ -1,8 +1,35 @@
-import os
+import logging
+import time
 
-import intersystems_iris.dbapi._DBAPI as iris
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 
-from dotenv import find_dotenv, load_dotenv
+from connection_pool import ConnectionPool, PoolStats, get_pool
+from embedding_tables import BASE_EMBEDDING_MODEL, embedding_columns, ready_generations
+from tracing import get_tracer, submit
+from vector_codec import EMBEDDING_DIMENSION, encode_vector, encode_vectors, vector_parameter
+
+logger = logging.getLogger(__name__)
+
+# Number of query embeddings combined into one UNION ALL statement by the search_many_* methods.
+MANY_QUERY_BATCH_SIZE = 16
+
+# How long a missing or empty chunk index is remembered before has_chunk_index checks again.
+CHUNK_INDEX_RECHECK_SECONDS = 60.0
+
+@dataclass
+class RetrievedContext:
+    documents: list = field(default_factory=list)  # (Story, StoryId) rows ranked by question similarity
+    story_documents: list = field(default_factory=list)  # (Story, StoryId) rows ranked by story similarity
+    q_and_a_docs: list = field(default_factory=list)  # [{'question': ..., 'answer': ...}] from the stories in documents
+    chunks: list = field(default_factory=list)  # (Chunk, StoryId, Score) rows ranked by chunk similarity
+    timings: dict = field(default_factory=dict)  # seconds per stage, plus 'total'
+    fused: bool = False
+
+def _statement_rejected(error: Exception) -> bool:
+    # DB-API drivers raise these for SQL the server can't parse or doesn't support, as opposed to
+    # connection, timeout or data errors, which say nothing about the statement itself.
+    return type(error).__name__ in ("ProgrammingError", "NotSupportedError")
 
 class VectorSearch:
     def __init__(
@@ -12,59 +39,235 @@ class VectorSearch:
         namespace: str | None = None,
         username: str | None = None,
         password: str | None = None,
+        pool: ConnectionPool | None = None,
+        batch_size: int = MANY_QUERY_BATCH_SIZE,
+        embedding_model: str = BASE_EMBEDDING_MODEL,
+        dimension: int = EMBEDDING_DIMENSION,
     ) -> None:
-        load_dotenv(find_dotenv(usecwd=True), override=True)
-
-        resolved_host = host or os.getenv("IRIS_HOST", "localhost")
-        resolved_port = int(port or os.getenv("IRIS_PORT", "51972"))
-        resolved_namespace = namespace or os.getenv("IRIS_NAMESPACE", "USER")
-        resolved_username = username or os.getenv("IRIS_USERNAME", "SuperUser")
-        resolved_password = password or os.getenv("IRIS_PASSWORD")
-
-        if not resolved_password:
-            raise ValueError("IRIS_PASSWORD is not set (set it in your environment or .env)")
-
-        self.conn = iris.connect(
-            resolved_host,
-            resolved_port,
-            resolved_namespace,
-            resolved_username,
-            resolved_password,
-        )
+        # Connections come from a process-wide pool, so constructing a VectorSearch is cheap.
+        self.pool = pool or get_pool(host, port, namespace, username, password)
+        self.batch_size = batch_size
+        self.fused_retrieval = True
+        self._executor = ThreadPoolExecutor(max_workers=self.pool.max_size, thread_name_prefix="vector-search")
+        # Queries run against embedding_model's vectors: the base columns, or that model's side tables (see reindex.py).
+        self.columns = embedding_columns(embedding_model, dimension)
+        self._vector_param = vector_parameter(self.columns.dimension)
+        self.tracer = get_tracer()
+        self._chunk_index_checked: tuple[bool, float] | None = None
+
+    def pool_stats(self) -> PoolStats:
+        return self.pool.stats()
+
+    def ready_embedding_models(self) -> dict[str, int]:
+        with self.pool.cursor() as iris_cursor:
+            return ready_generations(iris_cursor)
+
+    def _encode(self, query_embedding) -> str:
+        return encode_vector(query_embedding, self.columns.dimension)
         
+    # Ranking subqueries, shared by the single searches, the search_many_* batches and the fused
+    # statement. Each takes the query vector as its one parameter and selects (content, StoryId, Score).
+    def _question_ranking(self, top_k: int) -> str:
+        return f"""SELECT TOP {top_k} data.Story, data.StoryId,
+                       VECTOR_DOT_PRODUCT({self.columns.question_vector}, {self._vector_param}) AS Score
+                   FROM RAG_COQA.Story data
+                   JOIN {self.columns.question_table} vector
+                   ON vector.StoryID = data.StoryId
+                   ORDER BY Score DESC"""
+
+    def _story_ranking(self, top_k: int) -> str:
+        return f"""SELECT TOP {top_k} data.Story, data.StoryId,
+                       VECTOR_DOT_PRODUCT({self.columns.story_vector}, {self._vector_param}) AS Score
+                   FROM RAG_COQA.Story data
+                   {self.columns.story_join}
+                   ORDER BY Score DESC"""
+
+    def _chunk_ranking(self, top_k: int) -> str:
+        return f"""SELECT TOP {top_k} chunk.Chunk, chunk.StoryId,
+                       VECTOR_DOT_PRODUCT({self.columns.chunk_vector}, {self._vector_param}) AS Score
+                   FROM RAG_COQA.StoryChunk chunk
+                   {self.columns.chunk_join}
+                   ORDER BY Score DESC"""
+
+    def _examples_query(self, top_k: int, examples_top_k: int) -> str:
+        # Same as search_q_and_a_docs_by_story(search_by_q_and_a(...) IDs), but with the ranking as a
+        # subquery so it doesn't have to wait for the first round-trip.
+        return f"""SELECT TOP {examples_top_k} Question, Answer
+                   FROM RAG_COQA.QandA
+                   WHERE StoryID IN (SELECT StoryId FROM ({self._question_ranking(top_k)}))"""
+
+    def _fetch(self, span_name: str, query: str, query_embedding, **attributes) -> list[tuple]:
+        with self.tracer.span(span_name, **attributes) as span:
+            vector_param = self._encode(query_embedding)
+            with self.pool.cursor() as iris_cursor:
+                iris_cursor.execute(query, [vector_param])
+                rows = [tuple(row) for row in iris_cursor.fetchall()]
+            span.set(rows=len(rows), payload_bytes=len(vector_param))
+        return rows
+
     def search_by_q_and_a(self, query_embedding, top_k:int=4) -> list:
-        query = f"""SELECT TOP {top_k} data.Story, data.ID
-                    FROM RAG_COQA.Story data
-                    JOIN RAG_COQA.QandA vector
-                    ON vector.StoryID = data.ID
-                    ORDER BY VECTOR_DOT_PRODUCT(TO_VECTOR(vector.QuestionEmbedding), TO_VECTOR(?)) DESC
-                    """
-        iris_cursor = self.conn.cursor()
-        iris_cursor.execute(query, [str(query_embedding)])
-        origin_list = iris_cursor.fetchall()
-        return origin_list
-    
+        rows = self._fetch("vector_search.q_and_a", self._question_ranking(top_k), query_embedding, top_k=top_k)
+        return [row[:2] for row in rows]
+
     def search_by_story(self, query_embedding, top_k:int=2) -> list:
-        query = f"""SELECT TOP {top_k} data.Story, data.ID
-                    FROM RAG_COQA.Story data
-                    ORDER BY VECTOR_DOT_PRODUCT(TO_VECTOR(data.StoryEmbedding), TO_VECTOR(?)) DESC
-                    """
-        iris_cursor = self.conn.cursor()
-        iris_cursor.execute(query, [str(query_embedding)])
-        origin_list = iris_cursor.fetchall()
-        return origin_list
-    
+        rows = self._fetch("vector_search.story", self._story_ranking(top_k), query_embedding, top_k=top_k)
+        return [row[:2] for row in rows]
+
+    def search_chunks(self, query_embedding, top_k:int=8) -> list:
+        return self._fetch("vector_search.chunks", self._chunk_ranking(top_k), query_embedding, top_k=top_k)
+
+    def has_chunk_index(self) -> bool:
+        """Whether chunks have been loaded (see chunking.py) for this instance's embedding model."""
+        checked = self._chunk_index_checked
+        if checked and (checked[0] or time.monotonic() - checked[1] < CHUNK_INDEX_RECHECK_SECONDS):
+            return checked[0]
+        with self.pool.cursor() as iris_cursor:
+            iris_cursor.execute(
+                "SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = 'RAG_COQA' AND TABLE_NAME = ?",
+                [self.columns.chunk_table.split(".")[1]],
+            )
+            available = bool(iris_cursor.fetchone()[0])
+            if available:
+                iris_cursor.execute(f"SELECT TOP 1 1 FROM {self.columns.chunk_table}")
+                available = iris_cursor.fetchone() is not None
+        self._chunk_index_checked = (available, time.monotonic())
+        return available
+
     def search_q_and_a_docs_by_story(self, story_ids: list[str], top_k:int=1) -> list:
-        id_tuple = tuple(story_ids)
-        print(id_tuple)
+        if not story_ids:
+            return []
+        placeholders = ",".join("?" * len(story_ids))
         query = f"""SELECT TOP {top_k} Question, Answer
                     FROM RAG_COQA.QandA
-                    WHERE StoryID IN {id_tuple}
+                    WHERE StoryID IN ({placeholders})
                     """
-        iris_cursor = self.conn.cursor()
-        iris_cursor.execute(query)
-        resultset = list(iris_cursor.fetchall())
+        with self.tracer.span("vector_search.q_and_a_docs_by_story", top_k=top_k, story_ids=len(story_ids)) as span:
+            with self.pool.cursor() as iris_cursor:
+                iris_cursor.execute(query, list(story_ids))
+                resultset = list(iris_cursor.fetchall())
+            span.set(rows=len(resultset))
         q_and_a_list = [{'question':q_and_a[0], 'answer':q_and_a[1]} for q_and_a in resultset]
         return q_and_a_list
-    
-    
\ No newline at end of file
+
+    def _search_many(self, ranking, query_embeddings, top_k: int) -> list[list]:
+        # Each batch is one round-trip: a UNION ALL of per-embedding TOP k subqueries tagged with
+        # the embedding's position. Several batches run concurrently on separate pooled connections.
+        encoded = encode_vectors(query_embeddings, self.columns.dimension)
+        batches = [list(range(start, min(start + self.batch_size, len(encoded))))
+                   for start in range(0, len(encoded), self.batch_size)]
+
+        subquery = ranking(top_k)
+
+        def run_batch(indexes: list[int]) -> list:
+            query = "\nUNION ALL\n".join(f"SELECT {idx} AS QueryIndex, Story, StoryId, Score FROM ({subquery})" for idx in indexes)
+            with self.tracer.span("vector_search.many", top_k=top_k, queries=len(indexes)) as span:
+                with self.pool.cursor() as iris_cursor:
+                    iris_cursor.execute(query, [encoded[idx] for idx in indexes])
+                    rows = iris_cursor.fetchall()
+                span.set(rows=len(rows), payload_bytes=sum(len(encoded[idx]) for idx in indexes))
+            return rows
+
+        if len(batches) > 1:
+            futures = [submit(self._executor, run_batch, batch) for batch in batches]
+            batch_rows = [future.result() for future in futures]
+        else:
+            batch_rows = [run_batch(batch) for batch in batches]
+
+        # Rows are (QueryIndex, Story, StoryId, Score); UNION ALL doesn't preserve subquery order.
+        results = [[] for _ in encoded]
+        for rows in batch_rows:
+            for row in rows:
+                results[row[0]].append(row)
+        return [[tuple(row[1:3]) for row in sorted(group, key=lambda row: row[3], reverse=True)] for group in results]
+
+    def search_many_by_q_and_a(self, query_embeddings, top_k:int=4) -> list[list]:
+        return self._search_many(self._question_ranking, query_embeddings, top_k)
+
+    def search_many_by_story(self, query_embeddings, top_k:int=2) -> list[list]:
+        return self._search_many(self._story_ranking, query_embeddings, top_k)
+
+    def _q_and_a_examples_by_similarity(self, query_embedding, top_k: int, examples_top_k: int) -> list:
+        rows = self._fetch("vector_search.examples", self._examples_query(top_k, examples_top_k), query_embedding,
+                           top_k=top_k, examples_top_k=examples_top_k)
+        return [{'question':q_and_a[0], 'answer':q_and_a[1]} for q_and_a in rows]
+
+    def _retrieve_context_fused(self, vector_param: str, top_k: int, story_top_k: int, examples_top_k: int, chunk_top_k: int) -> RetrievedContext:
+        # One stage per subquery, each tagged with its name and taking the query vector once.
+        stages = [
+            f"SELECT 'documents' AS Stage, Story AS Content, CAST(StoryId AS VARCHAR(20)) AS Extra, Score FROM ({self._question_ranking(top_k)})",
+            f"SELECT 'story_documents', Story, CAST(StoryId AS VARCHAR(20)), Score FROM ({self._story_ranking(story_top_k)})",
+            f"SELECT 'q_and_a_docs', Question, Answer, NULL FROM ({self._examples_query(top_k, examples_top_k)})",
+        ]
+        if chunk_top_k:
+            stages.append(f"SELECT 'chunks', Chunk, CAST(StoryId AS VARCHAR(20)), Score FROM ({self._chunk_ranking(chunk_top_k)})")
+        query = "\nUNION ALL\n".join(stages)
+        parameters = [vector_param] * len(stages)
+        start = time.perf_counter()
+        with self.tracer.span("vector_search.fused", top_k=top_k, story_top_k=story_top_k, examples_top_k=examples_top_k,
+                              chunk_top_k=chunk_top_k) as span:
+            with self.pool.cursor() as iris_cursor:
+                iris_cursor.execute(query, parameters)
+                rows = iris_cursor.fetchall()
+            span.set(rows=len(rows), payload_bytes=sum(map(len, parameters)))
+        context = RetrievedContext(fused=True, timings={'fused': time.perf_counter() - start})
+
+        for stage, content, extra, score in rows:
+            if stage == 'q_and_a_docs':
+                context.q_and_a_docs.append({'question': content, 'answer': extra})
+            else:
+                getattr(context, stage).append((content, int(extra), score))
+        # UNION ALL doesn't preserve subquery order, so re-rank and drop the score.
+        context.documents = [row[:2] for row in sorted(context.documents, key=lambda row: row[2], reverse=True)]
+        context.story_documents = [row[:2] for row in sorted(context.story_documents, key=lambda row: row[2], reverse=True)]
+        context.chunks.sort(key=lambda row: row[2], reverse=True)
+        return context
+
+    def _retrieve_context_concurrent(self, query_embedding, top_k: int, story_top_k: int, examples_top_k: int, chunk_top_k: int) -> RetrievedContext:
+        def timed(stage: str, search, *args):
+            start = time.perf_counter()
+            result = search(*args)
+            return stage, result, time.perf_counter() - start
+
+        futures = [
+            submit(self._executor, timed, 'documents', self.search_by_q_and_a, query_embedding, top_k),
+            submit(self._executor, timed, 'story_documents', self.search_by_story, query_embedding, story_top_k),
+            submit(self._executor, timed, 'q_and_a_docs', self._q_and_a_examples_by_similarity, query_embedding, top_k, examples_top_k),
+        ]
+        if chunk_top_k:
+            futures.append(submit(self._executor, timed, 'chunks', self.search_chunks, query_embedding, chunk_top_k))
+        context = RetrievedContext()
+        for future in futures:
+            stage, result, seconds = future.result()
+            setattr(context, stage, [tuple(row) for row in result] if stage != 'q_and_a_docs' else result)
+            context.timings[stage] = seconds
+        return context
+
+    def retrieve_context(self, query_embedding, top_k:int=2, story_top_k:int=1, examples_top_k:int=1, chunk_top_k:int=0) -> RetrievedContext:
+        """Everything a chat turn needs from the vector store in (ideally) a single round-trip.
+
+        Equivalent to search_by_q_and_a, search_by_story and search_q_and_a_docs_by_story on the
+        first result's IDs, plus search_chunks when ``chunk_top_k`` is set (check has_chunk_index
+        first). The stages are sent as one UNION ALL statement. If that fails, this call runs them
+        concurrently on separate connections instead; only if the server rejects the statement
+        itself does this instance stop trying the fused one.
+        """
+        start = time.perf_counter()
+        context = None
+        # Raises for an embedding of the wrong size before anything is sent.
+        vector_param = self._encode(query_embedding)
+        with self.tracer.span("vector_search.retrieve_context", top_k=top_k, story_top_k=story_top_k) as span:
+            if self.fused_retrieval:
+                try:
+                    context = self._retrieve_context_fused(vector_param, top_k, story_top_k, examples_top_k, chunk_top_k)
+                except Exception as error:
+                    if _statement_rejected(error):
+                        logger.warning("Fused retrieval rejected by the server, running the stages separately from now on: %r", error)
+                        self.fused_retrieval = False
+                    else:
+                        logger.warning("Fused retrieval failed, running the stages separately for this call: %r", error)
+            if context is None:
+                context = self._retrieve_context_concurrent(query_embedding, top_k, story_top_k, examples_top_k, chunk_top_k)
+            span.set(fused=context.fused,
+                     rows=len(context.documents) + len(context.story_documents) + len(context.q_and_a_docs) + len(context.chunks))
+        context.timings['total'] = time.perf_counter() - start
+        return context